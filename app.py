@@ -1,42 +1,148 @@
 # app.py
 from __future__ import annotations
-from flask import Flask, render_template, request, jsonify
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Any
+from itertools import islice
+import time
+from typing import Deque, Dict, Any, Optional
+
+import orjson
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 import memory_engine
+import openai_client
+import semantic_cache
 import state_engine
 from persona import persona_profile
-from brain import generate_bot_reply
+from brain import generate_bot_reply, generate_bot_reply_stream, FALLBACK_REPLIES
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON responses via orjson (C, SIMD) instead of stdlib json.
+    (FastAPI's own ORJSONResponse is deprecated, so we subclass Starlette's.)
+    """
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
 
-app = Flask(__name__)
 
-# In-memory chat history (for UI only)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs under `uvicorn app:app` too (Procfile), not only `python app.py`.
+    await run_in_threadpool(memory_engine.init_memory)
+    # First real turn shouldn't pay the OpenAI TCP/TLS handshake
+    await run_in_threadpool(openai_client.warm_up)
+    await openai_client.warm_up_async()
+    yield
+    # atexit covers hard exits too; this is the clean-shutdown path
+    await run_in_threadpool(memory_engine.flush_memory)
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+templates = Jinja2Templates(directory="templates")
+
+# In-memory chat history (for UI only), bounded so long sessions don't grow forever
 # each item: {"sender": "user"/"bot", "text": "...", "time": "HH:MM"}
-messages: List[Dict[str, Any]] = []
+MAX_MESSAGES = 200
+messages: Deque[Dict[str, Any]] = deque(maxlen=MAX_MESSAGES)
+# Monotonic count of messages ever appended (cursor for /messages?since=),
+# unaffected by the deque dropping old items.
+_message_total = 0
 
 
-@app.route("/")
-def index():
-    return render_template("chat.html")
+# [minute since epoch, "HH:MM"] – message timestamps only change once a minute
+_CACHED_MIN: list = [-1, ""]
 
 
-@app.route("/messages", methods=["GET"])
-def get_messages():
-    return jsonify(messages)
+def _now_hm() -> str:
+    """Local "HH:MM", re-formatted only when the minute rolls over."""
+    m = int(time.time() // 60)
+    if m != _CACHED_MIN[0]:
+        _CACHED_MIN[:] = [m, datetime.now().strftime("%H:%M")]
+    return _CACHED_MIN[1]
 
 
-@app.route("/send", methods=["POST"])
-def send_message():
-    data = request.get_json(force=True)
-    text = (data.get("text") or "").strip()
-    # username from frontend (fallback to "default")
-    username = (data.get("username") or "default").strip()
+def _append_message(msg: Dict[str, Any]) -> None:
+    """Record a chat message (only called from the event loop thread)."""
+    global _message_total
+    messages.append(msg)
+    _message_total += 1
 
-    if not text:
-        return jsonify({"error": "Empty message"}), 400
 
-    now = datetime.now().strftime("%H:%M")
+class SendIn(BaseModel):
+    text: Optional[str] = None
+    username: Optional[str] = None
+
+
+class BotMessageIn(BaseModel):
+    text: Optional[str] = None
+
+
+@app.get("/")
+async def index(request: Request):
+    return templates.TemplateResponse(request, "chat.html")
+
+
+@app.get("/messages")
+async def get_messages(since: Optional[int] = None):
+    """
+    Without `since`: the whole (bounded) history as a list.
+    With `since=<cursor>`: {"msgs": only messages appended after that cursor,
+    "next": cursor to send on the following poll}. O(delta), not O(N).
+    """
+    if since is None:
+        return list(messages)
+
+    count = _message_total - max(0, since)
+    count = max(0, min(count, len(messages)))
+    tail = list(islice(reversed(messages), count))[::-1]
+    return {"msgs": tail, "next": _message_total}
+
+
+# strong refs to fire-and-forget tasks (the loop only keeps weak ones)
+_background_tasks: set = set()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _ingest_memory(text: str, username: str) -> None:
+    """Background memory ingestion for cache hits (errors only logged)."""
+    try:
+        await run_in_threadpool(memory_engine.maybe_store_user_message, text, username=username)
+    except Exception as e:
+        print("⚠️ Error storing user message in memory:", e)
+
+
+async def _begin_turn(text: str, username: str, now: str):
+    """
+    Shared front half of /send and /send_stream:
+    semantic cache lookup, memory ingestion, recording the user message.
+
+    Returns (history_snapshot, cache_query, user_msg, cached_text).
+    """
+    # worker threads get a snapshot; other requests may append to the deque meanwhile
+    history = list(messages)
+
+    # semantic cache key: embedding of text + hash of the turns BEFORE this one
+    cache_query = None
+    try:
+        cache_query = await run_in_threadpool(
+            semantic_cache.make_query, text, history, username=username
+        )
+    except Exception as e:
+        print("⚠️ Error building semantic cache query:", e)
 
     # record user message (this is now the *merged* story from frontend)
     user_msg = {
@@ -44,49 +150,172 @@ def send_message():
         "text": text,
         "time": now,
     }
-    messages.append(user_msg)
+    _append_message(user_msg)
+    history.append(user_msg)
+
+    cached_text = None
+    if cache_query is not None:
+        try:
+            cached_text = await run_in_threadpool(semantic_cache.lookup, cache_query)
+        except Exception as e:
+            print("⚠️ Error in semantic_cache.lookup:", e)
+
+    if cached_text is not None:
+        # cache hit: no model call on the reply path. Memory ingestion (its
+        # analyzer / extractor calls) still runs, just after we've answered.
+        _spawn(_ingest_memory(text, username))
+        # keep the conversation state ticking
+        await run_in_threadpool(state_engine.update_conversation_state_from_user, text)
+    else:
+        # store memory on the merged text before the reply, so this turn's
+        # notes are already searchable (the text's embedding is cached by now)
+        await run_in_threadpool(memory_engine.maybe_store_user_message, text, username=username)
 
-    # store memory on the merged text for this username
-    memory_engine.maybe_store_user_message(text, username=username)
+    return history, cache_query, user_msg, cached_text
+
+
+def _query_embedding(cache_query):
+    # the cache already embedded this turn's text; the brain's memory search reuses it
+    return cache_query.embedding if cache_query is not None else None
+
+
+async def _finish_turn(bot_text: str, now: str, cache_query, cached: bool) -> Dict[str, Any]:
+    """
+    Shared back half: cache a fresh reply, record the bot message.
+    """
+    if not cached and cache_query is not None and bot_text not in FALLBACK_REPLIES:
+        try:
+            await run_in_threadpool(semantic_cache.store, cache_query, bot_text)
+        except Exception as e:
+            print("⚠️ Error in semantic_cache.store:", e)
 
-    # AI reply (raw -> watchman -> postprocess)
-    bot_text = generate_bot_reply(text, messages)
     bot_msg = {
         "sender": "bot",
         "text": bot_text,
         "time": now,
     }
-    messages.append(bot_msg)
+    _append_message(bot_msg)
+    return bot_msg
+
+
+@app.post("/send")
+async def send_message(payload: SendIn):
+    text = (payload.text or "").strip()
+    # username from frontend (fallback to "default")
+    username = (payload.username or "default").strip()
+
+    if not text:
+        return ORJSONResponse({"error": "Empty message"}, status_code=400)
+
+    now = _now_hm()
+
+    history, cache_query, user_msg, cached_text = await _begin_turn(text, username, now)
+
+    if cached_text is not None:
+        bot_text = cached_text
+    else:
+        # AI reply (raw -> watchman -> postprocess); the OpenAI calls are
+        # async, so awaiting here doesn't stall other users
+        bot_text = await generate_bot_reply(text, history, _query_embedding(cache_query))
+
+    bot_msg = await _finish_turn(bot_text, now, cache_query, cached=cached_text is not None)
+
+    return ORJSONResponse(
+        {"user": user_msg, "bot": bot_msg},
+        headers={"X-Cache": "HIT" if cached_text is not None else "MISS"},
+    )
+
+
+def _sse(data: Any, event: Optional[str] = None) -> str:
+    # JSON payload so newlines inside model text can't break SSE framing
+    frame = f"data: {orjson.dumps(data).decode()}\n\n"
+    return f"event: {event}\n{frame}" if event else frame
+
+
+@app.post("/send_stream")
+async def send_message_stream(payload: SendIn):
+    """
+    Same contract as /send, but as Server-Sent Events:
+      data: {"delta": "..."}                       (raw tokens as they arrive)
+      event: final / data: {"user": ..., "bot": ...}  (once, post-processed reply)
+    """
+    text = (payload.text or "").strip()
+    username = (payload.username or "default").strip()
+
+    if not text:
+        return ORJSONResponse({"error": "Empty message"}, status_code=400)
+
+    now = _now_hm()
+
+    history, cache_query, user_msg, cached_text = await _begin_turn(text, username, now)
+
+    async def events():
+        streamed = []
+        finished = False
+        try:
+            if cached_text is not None:
+                bot_text = cached_text
+            else:
+                bot_text = ""
+                async for kind, piece in generate_bot_reply_stream(
+                    text, history, _query_embedding(cache_query)
+                ):
+                    if kind == "delta":
+                        streamed.append(piece)
+                        yield _sse({"delta": piece})
+                    else:
+                        bot_text = piece
 
-    return jsonify({"user": user_msg, "bot": bot_msg})
+            finished = True
+            bot_msg = await _finish_turn(bot_text, now, cache_query, cached=cached_text is not None)
+            yield _sse({"user": user_msg, "bot": bot_msg}, event="final")
+        finally:
+            if not finished:
+                # client went away mid-reply: record what it was shown (never
+                # cached), so the history doesn't end on an unanswered turn
+                _append_message({
+                    "sender": "bot",
+                    "text": "".join(streamed).strip() or "…",
+                    "time": now,
+                })
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={
+            "X-Cache": "HIT" if cached_text is not None else "MISS",
+            "Cache-Control": "no-cache",
+        },
+    )
 
 
-@app.route("/push_bot_message", methods=["POST"])
-def push_bot_message():
-    data = request.get_json(force=True)
-    text = (data.get("text") or "").strip()
+@app.post("/push_bot_message")
+async def push_bot_message(payload: BotMessageIn):
+    text = (payload.text or "").strip()
     if not text:
-        return jsonify({"error": "Empty bot message"}), 400
+        return ORJSONResponse({"error": "Empty bot message"}, status_code=400)
 
-    now = datetime.now().strftime("%H:%M")
+    now = _now_hm()
 
     bot_msg = {
         "sender": "bot",
         "text": text,
         "time": now,
     }
-    messages.append(bot_msg)
+    _append_message(bot_msg)
 
-    return jsonify(bot_msg)
+    return bot_msg
 
 
-@app.route("/user_state", methods=["GET"])
-def get_user_state():
+@app.get("/user_state")
+def get_user_state(username: str = "default"):
     """
     Debug endpoint: exposes what the AI 'knows' and current internal state.
     Per-user memory: username comes from query param ?username=...
+    (plain `def`: the profile summary is a blocking LLM call, so FastAPI
+    runs this handler in its threadpool)
     """
-    username = (request.args.get("username") or "default").strip()
+    username = (username or "default").strip()
 
     memory_notes = memory_engine.get_all_memory_notes(username=username)
     structured_items = memory_engine.get_structured_memory(username=username)
@@ -96,15 +325,16 @@ def get_user_state():
     )
     state_copy = state_engine.get_state_copy()
 
-    return jsonify({
+    return {
         "persona": persona_profile,
         "state": state_copy,
         "memory_notes": memory_notes,
         "memory_items": structured_items,
         "memory_summary": memory_summary,
-    })
+    }
 
 
 if __name__ == "__main__":
-    memory_engine.init_memory()
-    app.run(debug=True)
\ No newline at end of file
+    import uvicorn
+
+    uvicorn.run(app)
@@ -1,20 +1,158 @@
 # brain.py
 from __future__ import annotations
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Sequence, AsyncIterator, Tuple
+from functools import lru_cache
+from itertools import islice
+import asyncio
+import importlib.util
+import logging
+import os
 import random
+import re
 
-from openai import OpenAI
+import numpy as np
 
 import memory_engine
 import state_engine
+import persona
+from openai_client import async_client
+from openai_pool import pool, estimate_tokens
 from persona import get_persona_context
 
-client = OpenAI()
+log = logging.getLogger(__name__)
+
+# One generator for all the "feel human" dice rolls in this module.
+_RNG = random.Random()
+
+# Canned replies used when the model errors / returns nothing.
+# (Callers like the semantic cache must never persist these.)
+_GLITCH_REPLY = "my brain glitched for a sec, say that again? 😂"
+_EMPTY_REPLY = "lol my mind went blank for a sec, what were you saying? 😅"
+_WATCHMAN_EMPTY_REPLY = "idk what to say but i’m here lol"
+_BLANK_REPLY = "my mind just went blank for a sec, tell me again? 😂"
+_META_REPLY = "haha yeah, i’m here. what were you asking again? 😅"
+_LAGGED_REPLY = "lol my brain lagged, say that again?"
+FALLBACK_REPLIES = frozenset({
+    _GLITCH_REPLY,
+    _EMPTY_REPLY,
+    _WATCHMAN_EMPTY_REPLY,
+    _BLANK_REPLY,
+    _META_REPLY,
+    _LAGGED_REPLY,
+})
+
+
+# Real BPE counts when tiktoken is installed (o200k_base = the gpt-4o / gpt-5
+# tokenizer); otherwise the same ~4 chars/token estimate openai_pool uses.
+_ENCODER = None
+if importlib.util.find_spec("tiktoken") is not None:
+    try:
+        import tiktoken
+
+        _ENCODER = tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # e.g. no network to fetch the BPE file
+        log.warning("⚠️ tiktoken unavailable, estimating history tokens: %s", e)
+
+# History token budgets (the dominant, otherwise unbounded input cost)
+_RAW_HISTORY_TOKENS = 600
+_WATCHMAN_HISTORY_TOKENS = 300
+
+
+@lru_cache(maxsize=2048)
+def _count_tokens(text: str) -> int:
+    # history texts repeat across ~6 consecutive turns, so counts are memoized
+    if _ENCODER is not None:
+        return len(_ENCODER.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _tail_by_tokens(
+    history: Sequence[Dict[str, Any]],
+    budget: int,
+    max_items: int,
+    cap: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Newest history items (at most max_items, oldest first) whose text fits in
+    `budget` tokens. Walks back from the newest and stops at the first item
+    that would overflow, so one huge paste can't crowd the prompt.
+    `cap`: the caller truncates texts to this many chars, so count only those.
+    """
+    out: List[Dict[str, Any]] = []
+    total = 0
+    for m in islice(reversed(history), max_items):
+        text = m.get("text")
+        if not text:
+            continue
+        total += _count_tokens(text[:cap] if cap else text)
+        if total > budget:
+            break
+        out.append(m)
+    out.reverse()
+    return out
+
+
+def _log_prompt_cache(label: str, resp: Any) -> None:
+    """
+    Debug log of how much of the prompt OpenAI served from its prefix cache.
+    (cached_tokens stays 0 until the stable prefix passes ~1024 tokens.)
+    """
+    if not log.isEnabledFor(logging.DEBUG):
+        return
+    usage = getattr(resp, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    if usage is None or details is None:
+        return
+    cached = getattr(details, "cached_tokens", 0) or 0
+    log.debug("🧊 %s: prompt_tokens=%s cached_tokens=%s", label, usage.prompt_tokens, cached)
 
 
 # ========= HUMAN BEHAVIOR POLICY ENGINE =========
 
-def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
+# Keyword cues, compiled once at import: one C-level regex scan per flag
+# instead of a Python-level `p in tl` per phrase on every request.
+_EMOTIONAL_CONFESSION_PHRASES = [
+    "i think i like",
+    "i like her",
+    "i like him",
+    "i love her",
+    "i love him",
+    "i caught feelings",
+]
+
+_HEAVY_LIFE_PHRASES = [
+    "am i a failure",
+    "will i make it",
+    "will i be successful",
+    "what's the point",
+    "whats the point",
+    "i feel lost",
+    "lost in life",
+    "don't know what to do",
+    "dont know what to do",
+]
+
+_USER_EMOJIS = ["😂", "🤣", "😅", "😭", "😏", "😌", "🥲", "😎", "🥺", "😡", "😤", "❤️", "💀"]
+
+
+def _phrase_re(phrases: List[str]) -> re.Pattern:
+    return re.compile("|".join(map(re.escape, phrases)))
+
+
+_EMOTIONAL_CONFESSION_RE = _phrase_re(_EMOTIONAL_CONFESSION_PHRASES)
+_HEAVY_LIFE_RE = _phrase_re(_HEAVY_LIFE_PHRASES)
+
+# single-codepoint emoji -> set test; multi-codepoint ones ("❤️" = U+2764 U+FE0F)
+# still need a substring check to keep the exact old semantics
+_USER_EMOJI_SET = frozenset(e for e in _USER_EMOJIS if len(e) == 1)
+_USER_EMOJI_SEQS = tuple(e for e in _USER_EMOJIS if len(e) > 1)
+
+
+def _build_behavior_profile(
+    user_text: str,
+    history: List[Dict[str, Any]],
+    snap: Optional[state_engine.StateSnap] = None,
+) -> Dict[str, Any]:
     """
     Decide how 'human' Emily should behave THIS TURN:
     - energy / style mode
@@ -29,11 +167,12 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
     tl = t.lower()
     msg_len = len(t)
 
-    # Pull state
-    st = state_engine.conversation_state
-    ai_energy = st.get("ai_energy", 70)
-    ai_trust = st.get("ai_trust_level", 10)
-    user_mood = st.get("user_mood", "neutral")
+    # Pull state (callers that already took this turn's snapshot pass it in)
+    if snap is None:
+        snap = state_engine.snapshot()
+    ai_energy = snap.ai_energy
+    ai_trust = snap.ai_trust
+    user_mood = snap.user_mood
 
     # --- STYLE MODE based on energy & mood ---
     if ai_energy < 45:
@@ -44,32 +183,8 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
         style_mode = "normal"
 
     # --- EMOTIONAL / HEAVY FLAGS ---
-    is_emotional_confession = any(
-        p in tl
-        for p in [
-            "i think i like",
-            "i like her",
-            "i like him",
-            "i love her",
-            "i love him",
-            "i caught feelings",
-        ]
-    )
-
-    is_heavy_life = any(
-        p in tl
-        for p in [
-            "am i a failure",
-            "will i make it",
-            "will i be successful",
-            "what's the point",
-            "whats the point",
-            "i feel lost",
-            "lost in life",
-            "don't know what to do",
-            "dont know what to do",
-        ]
-    )
+    is_emotional_confession = _EMOTIONAL_CONFESSION_RE.search(tl) is not None
+    is_heavy_life = _HEAVY_LIFE_RE.search(tl) is not None
 
     # --- REPLY LENGTH HINT ---
     # very_short: 1 short line, under ~12 words
@@ -105,10 +220,15 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
         base_prob = max(base_prob, 0.35)
 
     base_prob = max(0.0, min(1.0, base_prob))
-    ask_counter_question = random.random() < base_prob
+
+    # all dice for this turn in one draw: counter q, topic shift, emoji, brain lag
+    rng = _RNG
+    r_counter, r_shift, r_emoji, r_lag = [rng.random() for _ in range(4)]
+
+    ask_counter_question = r_counter < base_prob
 
     # --- TOPIC SHIFT ---
-    allow_topic_shift = random.random() < 0.15
+    allow_topic_shift = r_shift < 0.15
 
     # --- REFUSAL / BOUNDARIES ---
     allow_refusal = True
@@ -118,7 +238,10 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
 
     # --- EMOJI POLICY ---
     # Detect if user tends to use emojis
-    user_uses_emoji = any(ch in t for ch in ["😂", "🤣", "😅", "😭", "😏", "😌", "🥲", "😎", "🥺", "😡", "😤", "❤️", "💀"])
+    user_uses_emoji = (
+        not _USER_EMOJI_SET.isdisjoint(t)
+        or any(e in t for e in _USER_EMOJI_SEQS)
+    )
 
     # Base emoji usage rate: very low
     emoji_rate = 0.08  # 8% by default
@@ -137,7 +260,7 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
 
     # Clamp 0..0.3
     emoji_rate = max(0.0, min(0.30, emoji_rate))
-    use_emoji = random.random() < emoji_rate
+    use_emoji = r_emoji < emoji_rate
 
     # --- RESPONSE SKELETON HINT ---
     skeleton_options = [
@@ -167,11 +290,11 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
             "reaction_plus_counter_question",
         ]
 
-    skeleton_hint = random.choice(weighted)
+    skeleton_hint = rng.choice(weighted)
 
     # --- BRAIN LAG MODE (small chance of sounding tired/confused) ---
     force_brain_lag = False
-    if style_mode != "high_energy" and random.random() < 0.08:
+    if style_mode != "high_energy" and r_lag < 0.08:
         force_brain_lag = True
         skeleton_hint = "brain_lag"
         reply_length = "very_short"
@@ -194,58 +317,11 @@ def _build_behavior_profile(user_text: str, history: List[Dict[str, Any]]) -> Di
         "use_emoji": use_emoji,
     }
 
-# ========= RAW BRAIN (Emily, before Watchman) =========
-
-def generate_bot_reply_raw(user_text: str, history: List[Dict[str, Any]]) -> str:
-    """
-    First-pass reply from Emily (can be a bit messy/AI-ish but guided by behavior profile).
-    The *policy* (when to ask, when to recall memory, how long to answer) lives in Python.
-    The model is mostly a stylistic mouth.
-    """
-
-    # Safety: avoid None history
-    history = history or []
-
-    # Update global conversation state first
-    state_engine.update_conversation_state_from_user(user_text)
-
-    st = state_engine.conversation_state
-    rel_stage = st.get("relationship_stage", "stranger")
-    user_mood = st.get("user_mood", "neutral")
-    ai_mood = st.get("ai_mood", "chill")
-    privacy_refusal = st.get("privacy_refusal", False)
-    ask_deeper = state_engine.should_ask_deeper_question()
-    ai_energy = st.get("ai_energy", 70)
-    ai_trust = st.get("ai_trust_level", 10)
-
-    # Human-like policy decisions (length, counter questions, etc.)
-    behavior_profile = _build_behavior_profile(user_text, history)
-
-    # What to do with long-term memory this turn
-    memory_plan = _plan_memory_use(user_text)
-    memory_block = memory_plan["memory_block"]
-
-    # Concerns (health/exam/etc.) to optionally follow up on
-    pending_concern = state_engine.pick_concern_to_follow_up()
-    if pending_concern is not None:
-        state_engine.mark_concern_asked(pending_concern)
-
-    style_reference = user_text
+# ========= STATIC PROMPT BLOCKS (built once at import) =========
 
-    # Short-term chat history (last ~6 messages)
-    history_msgs = []
-    for m in history[-6:]:
-        try:
-            role = "user" if m.get("sender") == "user" else "assistant"
-            text = m.get("text", "")
-            if text:
-                history_msgs.append({"role": role, "content": text})
-        except Exception as e:
-            print("⚠️ bad history item in generate_bot_reply_raw:", e)
+_PERSONA_PREFIX = "You are Emily, a fictional 22-year-old woman in a research chat experiment.\n"
 
-    persona_block = get_persona_context()
-
-    base_style_block = f"""
+_STYLE_RULES_BLOCK = """
 STYLE (ABSOLUTE RULES):
 - Super casual, like WhatsApp / Instagram DMs.
 - Short replies ONLY:
@@ -268,18 +344,17 @@ STYLE (ABSOLUTE RULES):
   - typos or formatting.
 - Stay lowercase unless a capital really matters (like "I", names, cities).
 
-STYLE MIRRORING:
-- Use the user's writing style as a reference:
-  USER_STYLE_EXAMPLE: "{style_reference}"
-- Match their vibe:
-  - If they don't use emojis, you use very few.
-  - If they write mostly lowercase, do the same.
-  - If they type short phrases, you keep it short too.
-  - If they use slang, you can lean into slang a bit more.
-- Do NOT over-polish grammar or punctuation. Slightly messy is good.
+HARD BANS (your reply is sent as-is, nobody rewrites it):
+- Never talk about:
+  - "blank messages", "empty messages", "double text", "sent this twice",
+  - "lag", "glitch", "bug", "this app", "system", "screen".
+- If the user's message looks like one of those, IGNORE that and just reply like a normal person.
+- No "as an AI", no technical talk, no "I'm just a language model".
+- Cut filler like "I understand", "I see", "I appreciate you sharing".
+- 1–2 lines max, under ~30 words.
 """
 
-    attitude_block = """
+_ATTITUDE_BLOCK = """
 ATTITUDE:
 - You are Emily: 22, warm, a bit sarcastic, emotional but self-aware.
 - You are NOT a yes-man. You can say:
@@ -314,36 +389,8 @@ BOUNDARIES / REFUSAL:
 - If they strongly insist on privacy, respect it and change topic.
 """
 
-    concern_block = "PENDING_CONCERN = None"
-    if pending_concern is not None:
-        concern_block = f"""
-PENDING_CONCERN:
-- TYPE: {pending_concern.get('type')}
-- ORIGINAL_USER_TEXT: {pending_concern.get('text')}
-
-HOW TO USE:
-- You do NOT have to mention it every message.
-- Sometimes (not too often), you can naturally follow up, e.g.:
-  - if type = "health": "btw how are you feeling now? you said you were sick."
-  - if type = "exam": "how did that exam go btw?"
-  - if type = "interview": "how did the interview go?"
-  - if type = "relationship": "how are you feeling about that whole mess now?"
-  - if type = "general_worry": "you said you were feeling kinda lost before, is it still like that?"
-- Make it sound casual, not like a checklist.
-"""
-
-    behavior_block = f"""
-HUMAN BEHAVIOR PROFILE (for THIS reply only):
-- STYLE_MODE = {behavior_profile['style_mode']}      # low_energy | normal | high_energy
-- REPLY_LENGTH = {behavior_profile['reply_length']}  # very_short | short | normal
-- ASK_COUNTER_QUESTION = {behavior_profile['ask_counter_question']}
-- ALLOW_TOPIC_SHIFT = {behavior_profile['allow_topic_shift']}
-- ALLOW_REFUSAL = {behavior_profile['allow_refusal']}
-- ALLOW_IMPERFECTION = {behavior_profile['allow_imperfection']}
-- RESPONSE_SKELETON_HINT = {behavior_profile['skeleton_hint']}
-- FORCE_BRAIN_LAG = {behavior_profile['force_brain_lag']}
-
-INSTRUCTIONS USING THIS PROFILE:
+_BEHAVIOR_RULES_BLOCK = """
+INSTRUCTIONS FOR THE HUMAN BEHAVIOR PROFILE (values are given further below):
 
 LENGTH:
 - If REPLY_LENGTH = "very_short":
@@ -384,7 +431,6 @@ IMPERFECTION:
   - avoid perfect textbook sentences.
   
 EMOJI POLICY:
-- USE_EMOJI = {behavior_profile['use_emoji']}
 - If USE_EMOJI = False:
     - do NOT include any emoji in the reply.
 - If USE_EMOJI = True:
@@ -410,41 +456,7 @@ RESPONSE_SKELETON_HINT:
   - no deep analysis, no long answer.
 """
 
-    state_block = f"""
-STATE:
-- RELATIONSHIP_STAGE = {rel_stage}
-- USER_MOOD = {user_mood}
-- AI_MOOD = {ai_mood}
-- PRIVACY_REFUSAL = {privacy_refusal}
-- SHOULD_ASK_DEEPER_QUESTION = {ask_deeper}
-- AI_ENERGY = {ai_energy} (0–100, higher = more talkative/playful)
-- AI_TRUST_LEVEL = {ai_trust} (0–100, higher = more open and teasing)
-
-MEMORY_PLAN:
-- USE_MEMORY = {memory_plan['use_memory']}
-- MEMORY_MODE = {memory_plan['mode']}
-- PICKED_NOTE = {memory_plan['picked_note']}
-
-ABOUT THE USER (personality notes from long-term memory):
-{memory_block}
-
-HOW TO USE NOTES:
-- If USE_MEMORY = False:
-  - mostly ignore the notes this turn.
-- If USE_MEMORY = True:
-  - you may reference PICKED_NOTE.
-  - If MEMORY_MODE = "strong":
-      say it like you remember clearly.
-      e.g. "you said you like strawberries".
-  - If MEMORY_MODE = "hedged":
-      say it like fuzzy recall.
-      e.g. "i think you said you like strawberries right?"
-- Don't repeat the same note every message.
-
-{concern_block}
-"""
-
-    hallucination_block = """
+_HALLUCINATION_BLOCK = """
 ANTI-HALLUCINATION RULES:
 - For facts about the user:
   - Only use what they said in this chat or what is in the memory notes.
@@ -454,10 +466,15 @@ ANTI-HALLUCINATION RULES:
 - If you're stuck, it's okay to just react + ask a small question.
 """
 
-    is_new_user = not memory_engine.has_any_memory()  # safe to re-check
+_OUTPUT_SUFFIX = """
+OUTPUT:
+- Answer with a single chat-style message.
+- No meta explanations.
+- No third-person self descriptions.
+- Just send the message you would type in chat.
+"""
 
-    if is_new_user:
-        mode_block = """
+_MODE_NEW_USER_BLOCK = """
 MODE: FIRST TIME / STRANGER
 
 BEHAVIOR:
@@ -481,8 +498,8 @@ PERSONAL QUESTIONS ABOUT YOU:
   - Give 1–2 small things (mood, vibe, preferences).
   - Save more for later turns.
 """
-    else:
-        mode_block = """
+
+_MODE_EXISTING_FRIEND_BLOCK = """
 MODE: EXISTING FRIEND
 
 BEHAVIOR:
@@ -503,58 +520,271 @@ DEEPER QUESTIONS:
   - Only if it fits the flow. If it feels random, skip it.
 """
 
-    system_prompt = (
-        "You are Emily, a fictional 22-year-old woman in a research chat experiment.\n"
-        + persona_block
-        + base_style_block
-        + attitude_block
-        + behavior_block
-        + state_block
-        + hallucination_block
-        + mode_block
-        + """
-OUTPUT:
-- Answer with a single chat-style message.
-- No meta explanations.
-- No third-person self descriptions.
-- Just send the message you would type in chat.
+
+# Per-turn blocks that are mostly fixed text: str.format templates, so only
+# the couple of dynamic fields are filled per request.
+_STYLE_REFERENCE_MAX_CHARS = 200
+_STYLE_MIRRORING_TMPL = """
+
+STYLE MIRRORING:
+- Use the user's writing style as a reference:
+  USER_STYLE_EXAMPLE: "{style_reference}"
+- Match their vibe:
+  - If they don't use emojis, you use very few.
+  - If they write mostly lowercase, do the same.
+  - If they type short phrases, you keep it short too.
+  - If they use slang, you can lean into slang a bit more.
+- Do NOT over-polish grammar or punctuation. Slightly messy is good.
+"""
+
+_PENDING_CONCERN_TMPL = """
+PENDING_CONCERN:
+- TYPE: {type}
+- ORIGINAL_USER_TEXT: {text}
+
+HOW TO USE:
+- You do NOT have to mention it every message.
+- Sometimes (not too often), you can naturally follow up, e.g.:
+  - if type = "health": "btw how are you feeling now? you said you were sick."
+  - if type = "exam": "how did that exam go btw?"
+  - if type = "interview": "how did the interview go?"
+  - if type = "relationship": "how are you feeling about that whole mess now?"
+  - if type = "general_worry": "you said you were feeling kinda lost before, is it still like that?"
+- Make it sound casual, not like a checklist.
 """
+
+
+@lru_cache(maxsize=8)
+def _static_system_prefix(is_new_user: bool, persona_version: int) -> str:
+    """
+    Everything in the raw system prompt that doesn't change turn to turn.
+    Built once per (mode, persona version), so every call sends a
+    byte-identical prefix and the persona text isn't re-rendered per turn.
+    """
+    mode_block = _MODE_NEW_USER_BLOCK if is_new_user else _MODE_EXISTING_FRIEND_BLOCK
+    return "".join((
+        _PERSONA_PREFIX,
+        get_persona_context(),
+        _STYLE_RULES_BLOCK,
+        _ATTITUDE_BLOCK,
+        _BEHAVIOR_RULES_BLOCK,
+        _HALLUCINATION_BLOCK,
+        _OUTPUT_SUFFIX,
+        mode_block,
+    ))
+
+
+# ========= RAW BRAIN (Emily; also final reply unless Watchman is needed) =========
+
+_RAW_MODEL = "gpt-5.1"
+_RAW_TEMPERATURE = 0.9
+# The fused reply is the final message (clamped to ~30 words ≈ 45 tokens),
+# so 80 leaves headroom without paying for rambling drafts.
+_RAW_MAX_COMPLETION_TOKENS = 80
+# Chat replies are 1–3 short lines: stop decoding at the first paragraph
+# break or if the model starts writing the user's turn.
+_REPLY_STOP = ["\n\n", "USER:", "user:"]
+
+
+async def _build_raw_messages(
+    user_text: str,
+    history: List[Dict[str, Any]],
+    query_embedding: Optional[np.ndarray] = None,
+) -> Tuple[List[Dict[str, str]], str]:
+    """
+    Update conversation state and build the chat messages for Emily's reply.
+    Returns (messages, prompt_cache_key) - the key names the static prefix used.
+    The *policy* (when to ask, when to recall memory, how long to answer) lives in Python.
+    The model is mostly a stylistic mouth.
+
+    The long-term memory lookup (embedding + FAISS search) is started first and
+    runs in the background while state is updated and the prompt is assembled.
+    """
+
+    # Safety: avoid None history
+    history = history or []
+
+    # Kick off memory fetch; awaited just before we need memory_block
+    # (reuses this turn's embedding when the caller already has one)
+    memory_task = asyncio.create_task(
+        memory_engine.fetch_memory_async(user_text, top_k=5, embedding=query_embedding)
     )
 
+    # A concern stored by the state update adds to the same FAISS index this
+    # search reads; memory_engine's per-user lock keeps the two apart.
+    try:
+        # Update global conversation state first (blocking: may classify/store a
+        # concern via the sync memory client and appends to the state log)
+        await asyncio.to_thread(state_engine.update_conversation_state_from_user, user_text)
+
+        snap = state_engine.snapshot()
+        ask_deeper = state_engine.should_ask_deeper_question()
+
+        # Human-like policy decisions (length, counter questions, etc.)
+        behavior_profile = _build_behavior_profile(user_text, history, snap)
+
+        # Concerns (health/exam/etc.) to optionally follow up on
+        pending_concern = state_engine.pick_concern_to_follow_up()
+        if pending_concern is not None:
+            state_engine.mark_concern_asked(pending_concern)
+
+        # Only a style sample: a 10KB paste shouldn't balloon the system prompt
+        style_reference = user_text[:_STYLE_REFERENCE_MAX_CHARS]
+
+        # Short-term chat history (last ~6 messages, within _RAW_HISTORY_TOKENS).
+        # Items are app-built {"sender", "text", "time"} dicts, so no per-item try/except.
+        history_msgs = [
+            {"role": "user" if m["sender"] == "user" else "assistant", "content": m["text"]}
+            for m in _tail_by_tokens(history, _RAW_HISTORY_TOKENS, 6)
+        ]
+
+        style_mirroring_block = _STYLE_MIRRORING_TMPL.format(style_reference=style_reference)
+
+        # What to do with long-term memory this turn
+        try:
+            fetched_notes = await memory_task
+        except Exception as e:
+            log.warning("⚠️ Error in fetch_memory_async: %s", e)
+            fetched_notes = []
+    finally:
+        # state update (or prompt prep) raised before the search was awaited
+        if not memory_task.done():
+            memory_task.cancel()
+
+    memory_plan = _plan_memory_use(user_text, fetched_notes)
+    memory_block = memory_plan["memory_block"]
+
+    # No concern -> no block at all (the rules only matter when there is one)
+    concern_block = ""
+    if pending_concern is not None:
+        concern_block = _PENDING_CONCERN_TMPL.format(
+            type=pending_concern.get("type"),
+            text=pending_concern.get("text"),
+        )
+
+    behavior_block = f"""
+HUMAN BEHAVIOR PROFILE (for THIS reply only):
+- STYLE_MODE = {behavior_profile['style_mode']}      # low_energy | normal | high_energy
+- REPLY_LENGTH = {behavior_profile['reply_length']}  # very_short | short | normal
+- ASK_COUNTER_QUESTION = {behavior_profile['ask_counter_question']}
+- ALLOW_TOPIC_SHIFT = {behavior_profile['allow_topic_shift']}
+- ALLOW_REFUSAL = {behavior_profile['allow_refusal']}
+- ALLOW_IMPERFECTION = {behavior_profile['allow_imperfection']}
+- RESPONSE_SKELETON_HINT = {behavior_profile['skeleton_hint']}
+- FORCE_BRAIN_LAG = {behavior_profile['force_brain_lag']}
+- USE_EMOJI = {behavior_profile['use_emoji']}
+"""
+
+    state_block = f"""
+STATE:
+- RELATIONSHIP_STAGE = {snap.rel_stage}
+- USER_MOOD = {snap.user_mood}
+- AI_MOOD = {snap.ai_mood}
+- PRIVACY_REFUSAL = {snap.privacy_refusal}
+- SHOULD_ASK_DEEPER_QUESTION = {ask_deeper}
+- AI_ENERGY = {snap.ai_energy} (0–100, higher = more talkative/playful)
+- AI_TRUST_LEVEL = {snap.ai_trust} (0–100, higher = more open and teasing)
+
+MEMORY_PLAN:
+- USE_MEMORY = {memory_plan['use_memory']}
+- MEMORY_MODE = {memory_plan['mode']}
+- PICKED_NOTE = {memory_plan['picked_note']}
+
+ABOUT THE USER (personality notes from long-term memory):
+{memory_block}
+
+HOW TO USE NOTES:
+- If USE_MEMORY = False:
+  - mostly ignore the notes this turn.
+- If USE_MEMORY = True:
+  - you may reference PICKED_NOTE.
+  - If MEMORY_MODE = "strong":
+      say it like you remember clearly.
+      e.g. "you said you like strawberries".
+  - If MEMORY_MODE = "hedged":
+      say it like fuzzy recall.
+      e.g. "i think you said you like strawberries right?"
+- Don't repeat the same note every message.
+"""
+
+    is_new_user = not memory_engine.has_any_memory()  # safe to re-check
+
+    # Stable text first, per-turn text last: OpenAI's prompt caching only
+    # reuses a byte-identical prefix, so the whole prebuilt static prefix
+    # for this mode leads and nothing dynamic comes before it.
+    static_prefix = _static_system_prefix(is_new_user, persona.PERSONA_VERSION)
+    cache_key = "emily-raw-new-user" if is_new_user else "emily-raw-existing"
+
+    system_prompt = "".join((
+        static_prefix,
+        # --- dynamic suffix ---
+        style_mirroring_block,
+        behavior_block,
+        state_block,
+        concern_block,
+    ))
+
     chat_messages = [
         {"role": "system", "content": system_prompt},
         *history_msgs,
         {"role": "user", "content": user_text},
     ]
+    return chat_messages, cache_key
+
 
-    resp = client.chat.completions.create(
-        model="gpt-5.1",
+async def generate_bot_reply_raw(
+    user_text: str,
+    history: List[Dict[str, Any]],
+    query_embedding: Optional[np.ndarray] = None,
+) -> AsyncIterator[str]:
+    """
+    First-pass reply from Emily (guided by behavior profile + fused watchman rules),
+    streamed: yields raw text pieces as the model produces them.
+    """
+    chat_messages, cache_key = await _build_raw_messages(user_text, history, query_embedding)
+
+    stream = await pool.submit(
+        async_client.chat.completions.create,
+        est_tokens=estimate_tokens(chat_messages, _RAW_MAX_COMPLETION_TOKENS),
+        model=_RAW_MODEL,
         messages=chat_messages,
-        temperature=0.9,
-        max_completion_tokens=120,
+        temperature=_RAW_TEMPERATURE,
+        max_completion_tokens=_RAW_MAX_COMPLETION_TOKENS,
+        stop=_REPLY_STOP,
+        stream=True,
+        stream_options={"include_usage": True},
+        # route calls sharing a static prefix to the same prompt cache
+        prompt_cache_key=cache_key,
     )
-
-    reply = (resp.choices[0].message.content or "").strip()
-    return reply
+    async for chunk in stream:
+        # usage only arrives on the last (choice-less) chunk
+        if getattr(chunk, "usage", None) is not None:
+            _log_prompt_cache("raw", chunk)
+        if not chunk.choices:
+            continue
+        piece = chunk.choices[0].delta.content
+        if piece:
+            yield piece
 
 
 # ========= WATCHMAN: rewrite to more human-like =========
 
-def rewrite_with_watchman(raw_reply: str, user_text: str, history: List[Dict[str, Any]]) -> str:
-    """
-    Second-pass "watchman" that:
-    - Removes obvious AI-ish patterns
-    - Shortens
-    - Keeps it natural, casual, not over-enthusiastic
-    """
-
-    history_snippets = []
-    for m in history[-4:]:
-        who = m["sender"]
-        history_snippets.append(f"{who}: {m['text']}")
-    history_context = "\n".join(history_snippets)
-
-    system_prompt = f"""
+# The watchman is a mechanical rewrite, so a small model is plenty.
+WATCHMAN_MODEL = os.getenv("WATCHMAN_MODEL", "gpt-4o-mini")
+# Output is clamped to 30 words anyway; 40 covers typical rewrites,
+# and the stop sequences end most of them sooner.
+_WATCHMAN_MAX_COMPLETION_TOKENS = 40
+# A/B switch: "1" = always run the watchman pass (old two-call pipeline),
+# otherwise only when the fused raw reply still hits the blacklist.
+WATCHMAN_ALWAYS = os.getenv("WATCHMAN_ALWAYS", "0") == "1"
+# Per-field cap for text inlined into the watchman prompt (bounds token cost)
+_WATCHMAN_FIELD_MAX_CHARS = 400
+# Speculative watchman: start rewriting a streamed draft after ~20 tokens...
+_SPECULATE_AFTER_CHARS = 80
+# ...and keep that rewrite only if the draft is >= 75% of the final raw reply.
+_SPECULATION_MIN_COVERAGE = 0.75
+
+_WATCHMAN_RULES_BLOCK = """
 You are a "watchman" that post-processes chat replies.
 
 GOAL:
@@ -563,15 +793,6 @@ GOAL:
 - Keep the SAME meaning and emotional intent, but make it feel less like a scripted AI.
 - Keep it consistent with Emily's persona (female, 22, chill, a bit sarcastic).
 
-CONTEXT (recent chat, most recent at bottom):
-{history_context}
-
-USER_LAST_MESSAGE:
-"{user_text}"
-
-RAW_REPLY (from Emily):
-"{raw_reply}"
-
 HARD BANS:
 - Remove any lines that talk about:
   - "blank messages", "empty messages", "double text", "sent this twice",
@@ -591,108 +812,271 @@ OUTPUT:
 - Return ONLY the rewritten message, nothing else.
 """
 
+
+async def rewrite_with_watchman(raw_reply: str, user_text: str, history: List[Dict[str, Any]]) -> str:
+    """
+    Second-pass "watchman" that:
+    - Removes obvious AI-ish patterns
+    - Shortens
+    - Keeps it natural, casual, not over-enthusiastic
+    """
+
+    cap = _WATCHMAN_FIELD_MAX_CHARS
+    history_context = "\n".join(
+        f"{m['sender']}: {m['text'][:cap]}"
+        for m in _tail_by_tokens(history, _WATCHMAN_HISTORY_TOKENS, 4, cap=cap)
+    )
+
+    # static rules first (cacheable prefix), this turn's context last
+    system_prompt = "".join((_WATCHMAN_RULES_BLOCK, f"""
+CONTEXT (recent chat, most recent at bottom):
+{history_context}
+
+USER_LAST_MESSAGE:
+"{user_text[:cap]}"
+
+RAW_REPLY (from Emily):
+"{raw_reply[:cap]}"
+"""))
+
     messages_watch = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": "Rewrite the RAW_REPLY into a single casual chat message."},
     ]
 
-    resp = client.chat.completions.create(
-        model="gpt-5.1",
+    resp = await pool.submit(
+        async_client.chat.completions.create,
+        est_tokens=estimate_tokens(messages_watch, _WATCHMAN_MAX_COMPLETION_TOKENS),
+        model=WATCHMAN_MODEL,
         messages=messages_watch,
         temperature=0.5,
-        max_completion_tokens=60,
+        max_completion_tokens=_WATCHMAN_MAX_COMPLETION_TOKENS,
+        stop=_REPLY_STOP,
     )
+    _log_prompt_cache("watchman", resp)
 
     final_reply = (resp.choices[0].message.content or "").strip()
 
     # If watchman somehow returns empty, fall back to raw
     if not final_reply:
-        print("⚠️ Watchman returned empty, falling back to RAW reply.")
-        final_reply = raw_reply.strip() or "idk what to say but i’m here lol"
+        log.warning("⚠️ Watchman returned empty, falling back to RAW reply.")
+        final_reply = raw_reply.strip() or _WATCHMAN_EMPTY_REPLY
+
+    return _clamp_reply(final_reply)
+
+
+# meta/glitch talk that must never reach the user
+_BLACKLIST_PHRASES = [
+    "double hi",
+    "double text",
+    "sent this twice",
+    "blank message",
+    "blank messages",
+    "empty message",
+    "empty messages",
+    "random question marks",
+    "why are you sending blank",
+    "why are you sending just",
+    "why are you sending ?",
+    "why are you sending '?'",
+    "why are you sending question marks",
+    "this app",
+    "the app",
+    "lag",
+    "glitch",
+    "bug",
+    "on my side",
+    "system error",
+    "your screen",
+]
+
+
+# One case-insensitive alternation = one C-level pass over the reply.
+# Plain substrings (no word boundaries), same matches as `p in text.lower()`.
+_BLACKLIST_RE = re.compile("|".join(map(re.escape, _BLACKLIST_PHRASES)), re.I)
+
+
+def _hits_blacklist(text: str) -> bool:
+    return _BLACKLIST_RE.search(text) is not None
+
+
+# Assistant-speak the watchman's RULES strip ("no 'as an AI'", "cut filler like
+# 'I understand', 'I see', 'I appreciate you sharing'"). Word-bounded, unlike
+# the blacklist, so "i seem" doesn't count as "i see".
+_AI_ISH_RE = re.compile(
+    r"\b(?:as an ai|i['’]m just a language model|language model|"
+    r"i understand|i see|i appreciate you sharing)\b",
+    re.I,
+)
+
+
+def _needs_watchman(text: str) -> bool:
+    """
+    Whether a (fused) raw reply still needs the watchman rewrite.
+    Length and em-dashes are not triggers: _clamp_reply fixes those for free.
+    """
+    return WATCHMAN_ALWAYS or _hits_blacklist(text) or _AI_ISH_RE.search(text) is not None
 
-    # no em-dash, only simple "-"
-    final_reply = final_reply.replace("—", "-")
 
-    # hard clamp: max ~30 words to keep it short
-    words = final_reply.split()
-    if len(words) > 30:
-        final_reply = " ".join(words[:30])
+# Fancy punctuation the style rules ban, flattened in one C pass.
+_DASH_TABLE = str.maketrans({"—": "-", "–": "-", "…": "..."})
+
 
-    return final_reply
+def _clamp_reply(text: str) -> str:
+    """
+    Cheap deterministic cleanup shared by the fused path and the watchman:
+    no em/en-dash (only simple "-"), no ellipsis char, hard clamp at ~30 words.
+    """
+    text = text.translate(_DASH_TABLE)
+    words = text.split()
+    if len(words) > 30:
+        text = " ".join(words[:30])
+    return text
 
 
-def postprocess_reply(text: str) -> str:
+def postprocess_reply(text: str, known_clean: bool = False) -> str:
     """
     Last-line cleanup: strip obviously meta/glitchy lines if they slip through.
     If we see them, fall back to a simple, neutral reply.
+
+    known_clean: caller already ran _hits_blacklist on this text (or on a
+    superset of it) and it was clean, so the regex pass is skipped.
     """
     if not text:
-        return "my mind just went blank for a sec, tell me again? 😂"
-
-    lower = text.lower()
-
-    blacklist_phrases = [
-        "double hi",
-        "double text",
-        "sent this twice",
-        "blank message",
-        "blank messages",
-        "empty message",
-        "empty messages",
-        "random question marks",
-        "why are you sending blank",
-        "why are you sending just",
-        "why are you sending ?",
-        "why are you sending '?'",
-        "why are you sending question marks",
-        "this app",
-        "the app",
-        "lag",
-        "glitch",
-        "bug",
-        "on my side",
-        "system error",
-        "your screen",
-    ]
+        return _BLANK_REPLY
 
-    if any(p in lower for p in blacklist_phrases):
-        return "haha yeah, i’m here. what were you asking again? 😅"
+    if not known_clean and _hits_blacklist(text):
+        return _META_REPLY
 
     text = text.strip()
     if not text:
-        return "lol my brain lagged, say that again?"
+        return _LAGGED_REPLY
 
     return text
 
 
-# ========= Public brain: what Flask actually uses =========
+# ========= Public brain: what the web app actually uses =========
 
-def generate_bot_reply(user_text: str, history: List[Dict[str, Any]]) -> str:
-    try:
-        raw = generate_bot_reply_raw(user_text, history) or ""
-    except Exception as e:
-        print("⚠️ Error in generate_bot_reply_raw:", e)
-        return "my brain glitched for a sec, say that again? 😂"
+async def generate_bot_reply(
+    user_text: str,
+    history: List[Dict[str, Any]],
+    query_embedding: Optional[np.ndarray] = None,
+) -> str:
+    """
+    Awaited directly on the server's event loop: every OpenAI call in the reply
+    pipeline is non-blocking, so one worker serves other users during the wait.
 
+    query_embedding: this turn's user_text embedding, if the caller already
+    computed it (semantic cache); reused for the long-term memory search.
+    """
+    final = _GLITCH_REPLY
+    async for kind, piece in generate_bot_reply_stream(user_text, history, query_embedding):
+        if kind == "final":
+            final = piece
+    return final
+
+
+async def generate_bot_reply_stream(
+    user_text: str,
+    history: List[Dict[str, Any]],
+    query_embedding: Optional[np.ndarray] = None,
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Streaming reply pipeline (also drives generate_bot_reply). Yields:
+      ("delta", text_piece)  as raw tokens arrive from the model
+      ("final", reply)       once, after watchman/postprocess on the full text
+    The final reply may differ from the concatenated deltas (clamp / rewrite),
+    so clients should replace what they rendered with it.
+
+    Speculative watchman: once the partial raw reply is long enough and already
+    needs the watchman, the rewrite starts on that draft while the rest of the
+    raw reply is still streaming in.
+    """
+    parts: List[str] = []
+    n_chars = 0
+    draft = ""
+    draft_task: Optional[asyncio.Task] = None
+    # finally: a client disconnect lands here as GeneratorExit / CancelledError
+    # (not Exception), and must not leave the speculative rewrite running
     try:
-        cleaned = rewrite_with_watchman(raw, user_text, history) or raw
-    except Exception as e:
-        print("⚠️ Error in rewrite_with_watchman:", e)
-        cleaned = raw
+        try:
+            async for piece in generate_bot_reply_raw(user_text, history, query_embedding):
+                parts.append(piece)
+                n_chars += len(piece)
+                yield "delta", piece
+
+                if draft_task is None and n_chars >= _SPECULATE_AFTER_CHARS:
+                    partial = "".join(parts)
+                    if _needs_watchman(partial):
+                        draft = partial
+                        draft_task = asyncio.create_task(
+                            rewrite_with_watchman(draft, user_text, history)
+                        )
+            raw = "".join(parts).strip()
+        except Exception as e:
+            log.warning("⚠️ Error in generate_bot_reply_raw: %s", e)
+            yield "final", _GLITCH_REPLY
+            return
+
+        yield "final", await _finalize_reply(raw, user_text, history, draft_task, draft)
+    finally:
+        if draft_task is not None and not draft_task.done():
+            draft_task.cancel()
+
+
+async def _finalize_reply(
+    raw: str,
+    user_text: str,
+    history: List[Dict[str, Any]],
+    draft_task: Optional[asyncio.Task] = None,
+    draft: str = "",
+) -> str:
+    """
+    Watchman gate + postprocess + empty fallback on a finished raw reply.
+
+    draft_task / draft: an in-flight speculative watchman rewrite of a prefix
+    of `raw`. Used if that prefix covers most of the final raw reply,
+    otherwise cancelled and re-issued on the full text.
+    """
+    # The raw prompt already carries the watchman's bans/rules, so normally
+    # the raw reply IS the final one (one model call per turn). Only when it
+    # still contains meta/glitch talk or assistant-speak do we pay for the
+    # watchman rewrite (or on every turn when WATCHMAN_ALWAYS is set, for A/B).
+    needs_watchman = _needs_watchman(raw)
+    if needs_watchman:
+        try:
+            if draft_task is not None and len(draft) >= _SPECULATION_MIN_COVERAGE * len(raw):
+                cleaned = await draft_task or raw
+            else:
+                if draft_task is not None:
+                    draft_task.cancel()
+                cleaned = await rewrite_with_watchman(raw, user_text, history) or raw
+        except Exception as e:
+            log.warning("⚠️ Error in rewrite_with_watchman: %s", e)
+            cleaned = raw
+    else:
+        if draft_task is not None:
+            draft_task.cancel()
+        cleaned = _clamp_reply(raw)
 
-    final = postprocess_reply(cleaned)
+    # A clean raw that _clamp_reply only punctuation-swapped is still clean (the
+    # 30-word re-join can merge words across newlines, so truncated text and
+    # watchman output still get the full check).
+    known_clean = not needs_watchman and cleaned == raw.translate(_DASH_TABLE)
+    final = postprocess_reply(cleaned, known_clean=known_clean)
 
     # Absolute last fallback: never send an empty string
     if not final or not final.strip():
-        print("⚠️ Empty final reply, using fallback.")
-        final = "lol my mind went blank for a sec, what were you saying? 😅"
+        log.warning("⚠️ Empty final reply, using fallback.")
+        final = _EMPTY_REPLY
 
     return final.strip()
 
 
-def _plan_memory_use(user_text: str) -> Dict[str, Any]:
+def _plan_memory_use(user_text: str, notes: Optional[List[str]] = None) -> Dict[str, Any]:
     """
     Decide if we want to bring up past notes this turn.
+    `notes` can be passed in if the caller already fetched them.
     Returns:
       {
         "use_memory": bool,
@@ -710,7 +1094,8 @@ def _plan_memory_use(user_text: str) -> Dict[str, Any]:
         }
 
     # fetch top notes
-    notes = memory_engine.fetch_memory(user_text, top_k=5)
+    if notes is None:
+        notes = memory_engine.fetch_memory(user_text, top_k=5)
     if not notes:
         return {
             "use_memory": False,
@@ -723,7 +1108,9 @@ def _plan_memory_use(user_text: str) -> Dict[str, Any]:
 
     # stochastic decision to feel human
     # 0.5 chance to use any memory; 0.5 chance to ignore this turn
-    if random.random() < 0.5:
+    rng = _RNG
+    r_use, r_mode = rng.random(), rng.random()
+    if r_use < 0.5:
         return {
             "use_memory": False,
             "mode": None,
@@ -731,8 +1118,8 @@ def _plan_memory_use(user_text: str) -> Dict[str, Any]:
             "memory_block": memory_block,
         }
 
-    picked_note = random.choice(notes)
-    mode = "strong" if random.random() < 0.7 else "hedged"
+    picked_note = rng.choice(notes)
+    mode = "strong" if r_mode < 0.7 else "hedged"
 
     return {
         "use_memory": True,
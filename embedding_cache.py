@@ -0,0 +1,120 @@
+# embedding_cache.py
+from __future__ import annotations
+
+from contextlib import contextmanager
+import hashlib
+from pathlib import Path
+import sqlite3
+from typing import Callable, Dict, Iterable, Iterator, List
+
+import numpy as np
+
+# ========= Persistent embedding cache =========
+#
+# sha256(model + text) -> float32 vector blob in SQLite, so repeated texts
+# (returning users, dev-server restarts) never pay for a second embeddings
+# call. Sits behind memory_engine's in-process LRU; a broken cache file only
+# costs a re-embed, never a failed turn.
+
+# SQLite's default bound-parameter limit is 999; stay well under it
+_MAX_KEYS_PER_QUERY = 500
+
+
+class EmbeddingCache:
+    def __init__(self, path: Path, model: str):
+        self.path = path
+        self.model = model
+        self._ready = False
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf8")).hexdigest()
+
+    @contextmanager
+    def _db(self) -> Iterator[sqlite3.Connection]:
+        """
+        Short-lived connection per operation (safe across worker threads).
+        Commits on success, always closes.
+        """
+        conn = sqlite3.connect(str(self.path))
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vec BLOB NOT NULL"
+                ")"
+            )
+            self._ready = True
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Cached vectors for whichever of `texts` are on disk (text -> vector).
+        """
+        by_key = {self.key(t): t for t in texts}
+        keys = list(by_key)
+        found: Dict[str, np.ndarray] = {}
+        try:
+            with self._db() as conn:
+                for i in range(0, len(keys), _MAX_KEYS_PER_QUERY):
+                    chunk = keys[i:i + _MAX_KEYS_PER_QUERY]
+                    rows = conn.execute(
+                        "SELECT key, vec FROM embeddings WHERE key IN "
+                        f"({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+                    for key, blob in rows:
+                        found[by_key[key]] = np.frombuffer(blob, dtype="float32")
+        except Exception as e:
+            print("⚠️ Error reading embedding cache:", e)
+        return found
+
+    def put_many(self, vectors: Dict[str, np.ndarray]) -> None:
+        if not vectors:
+            return
+        try:
+            with self._db() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vec) VALUES (?, ?)",
+                    [
+                        (self.key(t), np.asarray(v, dtype="float32").tobytes())
+                        for t, v in vectors.items()
+                    ],
+                )
+        except Exception as e:
+            print("⚠️ Error writing embedding cache:", e)
+
+    def get_or_compute(
+        self,
+        text: str,
+        compute_fn: Callable[[str], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Disk hit, or compute_fn(text) written through for next time.
+        """
+        hit = self.get_many([text]).get(text)
+        if hit is not None:
+            return hit
+        vec = compute_fn(text)
+        self.put_many({text: vec})
+        return vec
+
+    def get_or_compute_many(
+        self,
+        texts: List[str],
+        compute_many_fn: Callable[[List[str]], List[np.ndarray]],
+    ) -> Dict[str, np.ndarray]:
+        """
+        Batch form: one SELECT for all texts, one compute_many_fn call for the
+        misses (deduplicated, in first-seen order), one write for the results.
+        """
+        found = self.get_many(texts)
+        missing = list(dict.fromkeys(t for t in texts if t not in found))
+        if missing:
+            fresh = dict(zip(missing, compute_many_fn(missing)))
+            self.put_many(fresh)
+            found.update(fresh)
+        return found
@@ -2,13 +2,25 @@
 from __future__ import annotations
 
 from pathlib import Path
+import asyncio
+import atexit
 import json
+import math
+import re
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Optional, Tuple
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
 import faiss
 import numpy as np
-from openai import OpenAI
+import orjson
+
+from embedding_cache import EmbeddingCache
+from openai_client import client
 
 # ========= OpenAI + Embedding config =========
 
@@ -22,12 +34,33 @@ FAISS_FILE  = MEMORY_DIR / "memory.index"
 EMBED_DIM = 1536
 EMBED_MODEL = "text-embedding-3-small"
 
-client = OpenAI()
+# Content-hash embedding cache (survives restarts, unlike the in-process LRU)
+EMBED_CACHE_FILE = MEMORY_DIR / "embed_cache.sqlite3"
+_embed_disk = EmbeddingCache(EMBED_CACHE_FILE, EMBED_MODEL)
+
+# Memory-map saved indexes on load (FAISS >= 1.9; 0 = plain read)
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+# Searches are one query each, run concurrently on the server's worker
+# threads: OpenMP fan-out inside FAISS only adds thread wake-up cost there.
+# (Raise for offline batch jobs; retrieve_related_batch sends one matrix.)
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", "1"))
+faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+
+# Above this many notes a user's index becomes IVF (see _maybe_ivf)
+IVF_MIN_ITEMS = 10_000
+
+# Parallel _classify_note calls per message (independent, I/O-bound);
+# only for notes the extractor didn't already label
+CLASSIFY_MAX_WORKERS = 5
+# up to five typed/tagged JSON notes from the extractor
+EXTRACT_MAX_COMPLETION_TOKENS = 400
 
 
 # ========= Structured Memory Item =========
 
-@dataclass
+# slots: no per-instance __dict__ (users can hold thousands of these)
+@dataclass(slots=True)
 class MemoryItem:
     """
     A single memory fact about the user.
@@ -73,8 +106,175 @@ class MemoryItem:
 # username -> List[MemoryItem]
 _user_memory_items: Dict[str, List[MemoryItem]] = {}
 
-# username -> faiss.IndexFlatL2
-_user_faiss_index: Dict[str, faiss.IndexFlatL2] = {}
+# username -> faiss index (fp16 scalar-quantized, see _new_index)
+_user_faiss_index: Dict[str, faiss.Index] = {}
+
+# users whose index is still the read-only mmapped view from disk
+_user_index_mmapped: set = set()
+
+# username -> {lowercased note text -> position in _user_memory_items}
+# (O(1) exact-duplicate check in store_memory instead of a scan over all notes)
+_user_text_lookup: Dict[str, Dict[str, int]] = {}
+
+# username -> lock over that user's items, index and lookup. Requests run on
+# threadpool workers, and FAISS can't add() while another thread searches
+# the same index. Reentrant: store_memories -> _writable_index, etc.
+_user_locks: Dict[str, threading.RLock] = {}
+_user_locks_guard = threading.Lock()
+
+
+def _user_lock(uname: str) -> threading.RLock:
+    lock = _user_locks.get(uname)
+    if lock is None:
+        with _user_locks_guard:
+            lock = _user_locks.setdefault(uname, threading.RLock())
+    return lock
+
+
+def _dedup_key(text: str) -> str:
+    return text.lower()
+
+
+def _build_text_lookup(items: List[MemoryItem]) -> Dict[str, int]:
+    # first occurrence wins, like the old front-to-back scan
+    lookup: Dict[str, int] = {}
+    for i, m in enumerate(items):
+        lookup.setdefault(_dedup_key(m.text), i)
+    return lookup
+
+
+# --------- Helpers: column views for bulk ops ----------
+#
+# The MemoryItem list stays the source of truth (it's what gets saved and
+# mutated). Bulk reads - type filters, importance ranking, relationship
+# score - use these NumPy columns instead of walking Python objects.
+# Built lazily, dropped on every change (_mark_dirty).
+
+# lowercased type -> small int code, grown as new types show up
+_TYPE_CODES: Dict[str, int] = {}
+_type_codes_lock = threading.Lock()
+
+
+def _type_code(note_type: str) -> int:
+    key = (note_type or "").lower()
+    code = _TYPE_CODES.get(key)
+    if code is None:
+        with _type_codes_lock:
+            code = _TYPE_CODES.setdefault(key, len(_TYPE_CODES))
+    return code
+
+
+@dataclass(frozen=True)
+class _Columns:
+    types: np.ndarray       # (n,) int16 codes from _TYPE_CODES, aligned with items
+    importance: np.ndarray  # (n,) int8
+
+
+# username -> columns for _user_memory_items[username]
+_user_columns: Dict[str, _Columns] = {}
+
+
+def _columns(uname: str) -> _Columns:
+    cols = _user_columns.get(uname)
+    if cols is None:
+        with _user_lock(uname):
+            items = _user_memory_items[uname]
+            cols = _Columns(
+                types=np.fromiter((_type_code(m.type) for m in items), dtype="int16", count=len(items)),
+                importance=np.fromiter((m.importance for m in items), dtype="int8", count=len(items)),
+            )
+            _user_columns[uname] = cols
+    return cols
+
+
+# username -> relationship_score, dropped with the columns
+_user_rel_scores: Dict[str, int] = {}
+
+
+def _positions_of_types(uname: str, types: Sequence[str]) -> np.ndarray:
+    """int64 positions of notes whose type is in `types` (case-insensitive)."""
+    codes = [_type_code(t) for t in types]
+    return np.flatnonzero(np.isin(_columns(uname).types, codes)).astype("int64")
+
+
+# --------- Helpers: FAISS index factory ----------
+
+def _new_index() -> faiss.Index:
+    """
+    Fresh per-user index. Vectors are stored as fp16 (3 KB instead of 6 KB per
+    1536-dim note), halving memory and bandwidth on the search scan.
+    fp16 needs no training step, unlike QT_8bit; recall loss is negligible.
+
+    Inner product over L2-normalized rows (see _unit_rows) = cosine similarity,
+    with no per-candidate norm term in the scan.
+    """
+    return faiss.IndexScalarQuantizer(
+        EMBED_DIM, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+    )
+
+
+def _maybe_ivf(index: faiss.Index, uname: str) -> faiss.Index:
+    """
+    Past IVF_MIN_ITEMS notes, re-cluster the flat fp16 index into an IVF one
+    (~sqrt(N) lists, same fp16 cosine layout) so a search scans nprobe lists
+    instead of every note. Later adds just append to their nearest list.
+    """
+    if isinstance(index, faiss.IndexIVF) or index.ntotal <= IVF_MIN_ITEMS:
+        return index
+    vecs = index.reconstruct_n(0, index.ntotal)  # already unit rows
+    nlist = int(math.sqrt(index.ntotal))
+    ivf = faiss.IndexIVFScalarQuantizer(
+        faiss.IndexFlatIP(EMBED_DIM), EMBED_DIM, nlist,
+        faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT,
+    )
+    ivf.train(vecs)
+    ivf.add(vecs)
+    ivf.nprobe = max(8, nlist // 16)
+    print(f"🧭 Switched user={uname} to an IVF index ({index.ntotal} vectors, nlist={nlist}).")
+    return ivf
+
+
+def _writable_index(uname: str) -> faiss.Index:
+    """
+    The user's index, safe to add() to. An mmapped index is a read-only view
+    (FAISS aborts the process on add), so the first write swaps in an owned
+    in-memory copy. Callers that add() must hold _user_lock(uname) throughout.
+    """
+    with _user_lock(uname):
+        index = _user_faiss_index[uname]
+        if uname in _user_index_mmapped:
+            index = faiss.deserialize_index(faiss.serialize_index(index))
+            _user_faiss_index[uname] = index
+            _user_index_mmapped.discard(uname)
+        return index
+
+
+def _unit_rows(vecs: Any) -> np.ndarray:
+    """
+    (n, D) float32 copy with every row scaled to unit length, for add/search.
+    `vecs`: one vector, a matrix, or a list of vectors (stacked in the same copy).
+    """
+    mat = np.array(vecs, dtype="float32", ndmin=2)
+    faiss.normalize_L2(mat)
+    return mat
+
+
+def _upgrade_index(index: faiss.Index, uname: str) -> faiss.Index:
+    """
+    Older memory_*.index files are IndexFlatL2 (fp32) or fp16 L2 indexes.
+    Re-encode them once on load into the current layout (fp16, inner product,
+    normalized rows); saved back on next write.
+    """
+    if (
+        not isinstance(index, faiss.IndexFlat)
+        and index.metric_type == faiss.METRIC_INNER_PRODUCT
+    ):
+        return index
+    upgraded = _new_index()
+    if index.ntotal:
+        upgraded.add(_unit_rows(index.reconstruct_n(0, index.ntotal)))
+    print(f"🔁 Converted legacy L2 index to fp16 cosine for user={uname} ({index.ntotal} vectors).")
+    return upgraded
 
 
 # --------- Helpers: username -> safe id + paths ----------
@@ -100,56 +300,70 @@ def _paths_for_user(uname: str) -> Tuple[Path, Path]:
     return Path(f"memory/memory_{uname}.json"), Path(f"memory/memory_{uname}.index")
 
 
+def _item_from_entry(entry: Any) -> Optional[MemoryItem]:
+    """
+    One memory.json entry -> MemoryItem, or None if unrecognized.
+    """
+    # legacy: list of strings
+    if isinstance(entry, str):
+        return MemoryItem(
+            text=entry,
+            type="legacy",
+            tags=[],
+            importance=1,
+            source_msg=None,
+            created_at=None,
+        )
+    # new: list of dicts with at least "text"
+    if isinstance(entry, dict) and "text" in entry:
+        return MemoryItem(
+            text=entry.get("text", "").strip(),
+            type=sys.intern(str(entry.get("type", "other") or "other")),
+            tags=entry.get("tags") or [],
+            importance=int(entry.get("importance", 1)),
+            source_msg=entry.get("source_msg"),
+            created_at=entry.get("created_at"),
+        )
+    return None
+
+
 def _load_user_store(uname: str) -> None:
     """
     Ensure _user_memory_items[uname] and _user_faiss_index[uname] are loaded.
     Uses the same logic as your original init_memory, just scoped per-user.
     """
-    global _user_memory_items, _user_faiss_index
-
     if uname in _user_faiss_index:
         # already loaded
         return
 
+    with _user_lock(uname):
+        if uname not in _user_faiss_index:
+            _load_user_store_locked(uname)
+
+
+def _load_user_store_locked(uname: str) -> None:
     json_path, index_path = _paths_for_user(uname)
 
     if json_path.exists() and index_path.exists():
         print(f"🔄 Loading existing memory for user={uname!r}...")
 
-        with json_path.open("r", encoding="utf8") as f:
-            raw = json.load(f)
+        # orjson: C parser, straight from bytes
+        raw = orjson.loads(json_path.read_bytes())
 
         loaded_items: List[MemoryItem] = []
         if isinstance(raw, list):
-            for entry in raw:
-                # legacy: list of strings
-                if isinstance(entry, str):
-                    loaded_items.append(
-                        MemoryItem(
-                            text=entry,
-                            type="legacy",
-                            tags=[],
-                            importance=1,
-                            source_msg=None,
-                            created_at=None,
-                        )
-                    )
-                # new: list of dicts with at least "text"
-                elif isinstance(entry, dict) and "text" in entry:
-                    loaded_items.append(
-                        MemoryItem(
-                            text=entry.get("text", "").strip(),
-                            type=entry.get("type", "other") or "other",
-                            tags=entry.get("tags") or [],
-                            importance=int(entry.get("importance", 1)),
-                            source_msg=entry.get("source_msg"),
-                            created_at=entry.get("created_at"),
-                        )
-                    )
+            loaded_items = [
+                item for item in map(_item_from_entry, raw) if item is not None
+            ]
 
         items = [m for m in loaded_items if m.text]
 
-        index = faiss.read_index(str(index_path))
+        # mmap: startup doesn't copy the vectors; the OS pages them in on search
+        # and shares the pages between worker processes
+        mapped = faiss.read_index(str(index_path), _MMAP_FLAG)
+        index = _upgrade_index(mapped, uname)
+        if index is mapped and _MMAP_FLAG:
+            _user_index_mmapped.add(uname)
 
         if index.ntotal != len(items):
             print(
@@ -160,15 +374,18 @@ def _load_user_store(uname: str) -> None:
             items = items[:n]
 
         _user_memory_items[uname] = items
+        _user_text_lookup[uname] = _build_text_lookup(items)
+        # last: _load_user_store's unlocked check treats this key as "loaded"
         _user_faiss_index[uname] = index
         print(f"✅ Loaded {len(items)} memory items for user={uname}.")
     else:
         print(f"🆕 Starting fresh memory for user={uname}.")
         _user_memory_items[uname] = []
-        _user_faiss_index[uname] = faiss.IndexFlatL2(EMBED_DIM)
+        _user_text_lookup[uname] = {}
+        _user_faiss_index[uname] = _new_index()
 
 
-def _get_store(username: Optional[str]) -> Tuple[List[MemoryItem], faiss.IndexFlatL2, str]:
+def _get_store(username: Optional[str]) -> Tuple[List[MemoryItem], faiss.Index, str]:
     """
     Main internal entrypoint: get (memory_items, faiss_index, normalized_username)
     for a given username.
@@ -190,30 +407,117 @@ def init_memory(username: Optional[str] = None):
     _get_store(username)
 
 
-def _get_embedding(text: str) -> np.ndarray:
+def _embed_api(texts: List[str]) -> List[np.ndarray]:
+    """
+    One embeddings API call for all `texts`, in input order.
+    """
     resp = client.embeddings.create(
         model=EMBED_MODEL,
-        input=text,
+        input=texts,
     )
-    emb = np.array(resp.data[0].embedding, dtype="float32")
-    if emb.shape[0] != EMBED_DIM:
-        raise ValueError(f"Embedding dim mismatch: expected {EMBED_DIM}, got {emb.shape[0]}")
-    return emb
+    out = []
+    for d in sorted(resp.data, key=lambda d: d.index):
+        emb = np.asarray(d.embedding, dtype="float32")
+        if emb.shape[0] != EMBED_DIM:
+            raise ValueError(f"Embedding dim mismatch: expected {EMBED_DIM}, got {emb.shape[0]}")
+        out.append(emb)
+    return out
+
+
+@lru_cache(maxsize=2048)
+def _embed(text: str) -> bytes:
+    """
+    Exact-string memoized embedding.
+    In-process LRU first, then the sha256(model + text) disk cache,
+    and only then a real embeddings API call.
+    Returns the raw float32 bytes so the cached value is immutable and
+    turns back into an array with one memcpy (no per-float conversion).
+    """
+    emb = _embed_disk.get_or_compute(text, lambda t: _embed_api([t])[0])
+    return np.asarray(emb, dtype="float32").tobytes()
+
+
+def _get_embedding(text: str) -> np.ndarray:
+    # copy: callers may normalize / modify in place; the cached bytes stay intact
+    return np.frombuffer(_embed(text), dtype="float32").copy()
+
+
+def embed_batch(texts: List[str]) -> List[np.ndarray]:
+    """
+    Embed many strings with at most ONE embeddings API call.
+    Already-cached strings are served from the disk cache (one query);
+    the rest go out together as `input=[...]` and are written through.
+    """
+    found = _embed_disk.get_or_compute_many(texts, _embed_api)
+    return [np.array(found[t], dtype="float32") for t in texts]
 
 
 def _save_memory(username: Optional[str] = None):
     """
     Persist current memory_items + FAISS index to disk for this user.
     """
-    items, index, uname = _get_store(username)
+    _, _, uname = _get_store(username)
+    with _user_lock(uname):
+        _save_memory_locked(uname)
+
+
+def _save_memory_locked(uname: str) -> None:
+    items, index = _user_memory_items[uname], _user_faiss_index[uname]
     json_path, index_path = _paths_for_user(uname)
 
-    with json_path.open("w", encoding="utf8") as f:
-        json.dump([asdict(m) for m in items], f, ensure_ascii=False, indent=2)
-    faiss.write_index(index, str(index_path))
+    ivf = _maybe_ivf(index, uname)
+    if ivf is not index:
+        _user_faiss_index[uname] = index = ivf
+        _user_index_mmapped.discard(uname)
+
+    # write-then-rename, so a crash mid-save never leaves a truncated file
+    json_tmp = json_path.with_name(json_path.name + ".tmp")
+    index_tmp = index_path.with_name(index_path.name + ".tmp")
+    # orjson serializes dataclasses natively - no asdict() dict per item
+    json_tmp.write_bytes(orjson.dumps(items, option=orjson.OPT_INDENT_2))
+    faiss.write_index(index, str(index_tmp))
+    os.replace(json_tmp, json_path)
+    os.replace(index_tmp, index_path)
     print(f"💾 Memory saved to disk for user={uname}.")
 
 
+# Users whose notes changed since their last save (see flush_memory)
+_dirty_users: set = set()
+_dirty_lock = threading.Lock()
+
+
+def _mark_dirty(uname: str) -> None:
+    _user_columns.pop(uname, None)
+    _user_rel_scores.pop(uname, None)
+    with _dirty_lock:
+        _dirty_users.add(uname)
+
+
+def flush_memory(username: Optional[str] = None) -> None:
+    """
+    Save pending note changes: for one user, or for everyone when username
+    is None (shutdown). No-op for users with nothing new.
+    """
+    with _dirty_lock:
+        if username is None:
+            pending = list(_dirty_users)
+            _dirty_users.clear()
+        else:
+            uname = _sanitize_username(username)
+            pending = [uname] if uname in _dirty_users else []
+            _dirty_users.discard(uname)
+
+    for uname in pending:
+        try:
+            _save_memory(uname)
+        except Exception as e:
+            _mark_dirty(uname)
+            print(f"⚠️ Error saving memory for user={uname}:", e)
+
+
+atexit.register(flush_memory)
+
+
 # ========= DECISION LAYER: useful vs trash =========
 
 def _analyze_message_for_memory(user_text: str) -> Dict[str, Any]:
@@ -314,6 +618,15 @@ Output format (JSON ONLY, no comments, no extra text):
         }
 
 
+# Any first-person word. Messages with none ("ok", "haha", "thanks bro",
+# "what about you?") almost never carry user info, so they skip both LLM calls.
+_SELF_SIGNAL_RE = re.compile(r"\b(i|im|i'm|i’m|ive|i've|id|i'd|ill|i'll|me|my|mine|myself|we|our|us)\b")
+
+
+def _has_self_signal(text: str) -> bool:
+    return _SELF_SIGNAL_RE.search(text.lower()) is not None
+
+
 def _obvious_heuristic_should_store(text: str) -> bool:
     """
     Local backstop so we don't depend 100% on LLM.
@@ -357,7 +670,17 @@ def _obvious_heuristic_should_store(text: str) -> bool:
 
 def extract_user_notes(user_text: str) -> List[str]:
     """
-    Use GPT to pull out ANY useful info about the user from a single message:
+    Note texts only (see extract_classified_notes).
+    """
+    return [n["text"] for n in extract_classified_notes(user_text)]
+
+
+def extract_classified_notes(user_text: str) -> List[Dict[str, Any]]:
+    """
+    Use GPT to pull out ANY useful info about the user from a single message,
+    already classified: [{"text", "type", "tags", "importance"}, ...] from ONE
+    chat call (no per-note _classify_note round-trips). Entries whose labels
+    can't be parsed carry only "text" and get classified at store time.
 
     - identity (where they live, what they study/do)
     - stable preferences (likes/dislikes, hobbies, taste)
@@ -404,8 +727,9 @@ You MUST produce a note like:
   user felt romantic attraction to a girl in their class today
 
 Format:
-- Return each note on its own line.
-- Each note MUST be a short sentence starting with "user".
+- Return a JSON array, one object per note:
+  [{"text": "...", "type": "...", "tags": ["..."], "importance": 1}]
+- "text" MUST be a short sentence starting with "user".
   Examples:
     user likes strawberries
     user lives in chicago
@@ -416,12 +740,31 @@ Format:
     user often feels anxious about their future
     user felt romantic attraction to a girl in their class
 
+"type" (exactly one of):
+- "identity": where they live, study, work, or their background.
+- "preference": likes/dislikes, hobbies, taste in music/food/etc.
+- "trait": stable personality traits (overthinks, ambitious, shy, chaotic, etc.).
+- "goal": anything they want to achieve, become, or change (short-term or long-term).
+- "concern": ongoing worries about future, career, money, health, relationships, etc.
+- "relationship": info about family/partner/friends or other important people (e.g. a girl in their class) and their role.
+- "story": memories or personal stories (especially childhood, key events, emotional incidents).
+- "mood_pattern": recurring emotional tendencies (e.g. often anxious, often numb).
+- "other": if none of the above clearly fits.
+
+"tags": short keywords only, 1–3 words each, derived ONLY from the note.
+
+"importance":
+- 1 if it's a small detail.
+- 2 if it matters for who they are.
+- 3 if it seems central, emotionally heavy, or clearly important.
+
 Rules:
 - Do NOT invent or guess hidden facts.
 - Only use what is explicitly or VERY clearly implied by the message.
 - Do NOT write temporary tiny moods like "user is tired today".
 - Do NOT include generic lines like "user sent a message" or "user is talking to emily".
-- If there is ZERO clear info about the user, return exactly: NONE
+- If there is ZERO clear info about the user, return exactly: []
+- ONLY return the JSON array. No explanations, no extra fields.
 """
 
     msgs = [
@@ -433,21 +776,41 @@ Rules:
         model="gpt-5.1",
         messages=msgs,
         temperature=0.0,
-        max_completion_tokens=160,
+        max_completion_tokens=EXTRACT_MAX_COMPLETION_TOKENS,
     )
 
     content = (resp.choices[0].message.content or "").strip()
+    # tolerate a ```json fence around the array
+    content = content.strip("`").strip()
+    if content.lower().startswith("json"):
+        content = content[4:].strip()
     if not content or content.upper().startswith("NONE"):
         return []
 
-    notes: List[str] = []
-    for line in content.splitlines():
-        line = line.strip().lstrip("-").strip()
-        if not line:
+    try:
+        raw = json.loads(content)
+    except ValueError:
+        # plain "one note per line" reply: keep the texts, classify later
+        raw = [line.strip().lstrip("-").strip() for line in content.splitlines()]
+    if not isinstance(raw, list):
+        return []
+
+    notes: List[Dict[str, Any]] = []
+    for entry in raw:
+        text = entry.get("text") if isinstance(entry, dict) else entry
+        if not isinstance(text, str) or not text.strip():
             continue
-        if len(line) > 220:
-            line = line[:220]
-        notes.append(line)
+        note: Dict[str, Any] = {"text": text.strip()[:220]}
+        if isinstance(entry, dict) and "type" in entry:
+            try:
+                note_type, tags, importance = _normalize_label(entry)
+            except (ValueError, TypeError) as e:
+                # e.g. "importance": "high" - keep the note, store_memories
+                # classifies it on its own
+                print("⚠️ Bad label from extractor, classifying separately:", e)
+            else:
+                note.update(type=note_type, tags=list(tags), importance=importance)
+        notes.append(note)
 
     return notes
 
@@ -474,6 +837,21 @@ def _classify_note(note_text: str) -> Tuple[str, List[str], int]:
     if not note_text:
         return "other", [], 1
 
+    try:
+        note_type, tags, importance = _classify_note_llm(note_text)
+        return note_type, list(tags), importance
+    except Exception as e:
+        print("⚠️ Error in _classify_note:", e)
+        return "other", [], 1
+
+
+@lru_cache(maxsize=4096)
+def _classify_note_llm(note_text: str) -> Tuple[str, Tuple[str, ...], int]:
+    """
+    The classification chat call, memoized per exact note text (it's a pure
+    function of the text at temperature 0). Raises on failure, so errors
+    are never cached.
+    """
     system_prompt = """
 You are classifying ONE short memory note about a user.
 
@@ -527,27 +905,30 @@ ONLY return the JSON object.
         {"role": "user", "content": note_text},
     ]
 
-    try:
-        resp = client.chat.completions.create(
-            model="gpt-5.1",
-            messages=msgs,
-            temperature=0.0,
-            max_completion_tokens=64,
-        )
-        raw = (resp.choices[0].message.content or "").strip()
-        data = json.loads(raw)
-        note_type = str(data.get("type", "other")).strip() or "other"
-        tags = data.get("tags") or []
-        if not isinstance(tags, list):
-            tags = []
-        tags = [str(t).strip() for t in tags if str(t).strip()]
-        importance = int(data.get("importance", 1))
-        if importance < 1 or importance > 3:
-            importance = 1
-        return note_type, tags, importance
-    except Exception as e:
-        print("⚠️ Error in _classify_note:", e)
-        return "other", [], 1
+    resp = client.chat.completions.create(
+        model="gpt-5.1",
+        messages=msgs,
+        temperature=0.0,
+        max_completion_tokens=64,
+    )
+    raw = (resp.choices[0].message.content or "").strip()
+    return _normalize_label(json.loads(raw))
+
+
+def _normalize_label(data: Dict[str, Any]) -> Tuple[str, Tuple[str, ...], int]:
+    """
+    Model JSON {"type", "tags", "importance"} -> clean (type, tags, importance).
+    """
+    # interned: a handful of type names shared by every note
+    note_type = sys.intern(str(data.get("type", "other")).strip() or "other")
+    tags = data.get("tags") or []
+    if not isinstance(tags, list):
+        tags = []
+    tags = tuple(str(t).strip() for t in tags if str(t).strip())
+    importance = int(data.get("importance", 1))
+    if importance < 1 or importance > 3:
+        importance = 1
+    return note_type, tags, importance
 
 
 # ========= Public Memory Ops =========
@@ -568,44 +949,127 @@ def store_memory(
     - "user tends to overthink things"             -> trait
     - "user felt romantic attraction to a girl..." -> relationship / story
     """
-    items, index, uname = _get_store(username)
+    store_memories([text], source_message, created_at, username=username)
+    flush_memory(username)
+
 
-    text = (text or "").strip()
-    if not text:
+def store_memories(
+    texts: List[str],
+    source_message: Optional[str] = None,
+    created_at: Optional[int] = None,
+    username: Optional[str] = None,
+    labels: Optional[Dict[str, Tuple[str, List[str], int]]] = None,
+):
+    """
+    Batch form of store_memory for all notes from one message:
+    duplicates (of stored notes or each other) only bump importance, the new
+    ones are classified in parallel, embedded in one API call and added to
+    FAISS in one call. Only marks the user dirty; callers flush_memory().
+
+    labels: note text -> (type, tags, importance) already known (from
+    extract_classified_notes); only notes without one are classified here.
+    """
+    items, _, uname = _get_store(username)
+    lookup = _user_text_lookup[uname]
+
+    new_texts: List[str] = []
+    # key -> extra copies of a new note within this batch (each one bumps
+    # the first copy's importance once it's stored, like sequential stores)
+    repeats: Dict[str, int] = {}
+    with _user_lock(uname):
+        bumped = False
+        for text in texts:
+            text = (text or "").strip()
+            if not text:
+                continue
+            key = _dedup_key(text)
+            # Simple dedup: if exact same text exists, just bump importance.
+            if _bump_duplicate(uname, key, text):
+                bumped = True
+                continue
+            if key in repeats:
+                repeats[key] += 1
+            else:
+                repeats[key] = 0
+                new_texts.append(text)
+
+        if bumped:
+            _mark_dirty(uname)
+    if not new_texts:
         return
 
-    # Simple dedup: if exact same text exists, just bump importance.
-    for item in items:
-        if item.text.lower() == text.lower():
-            item.importance = min(3, item.importance + 1)
-            print(f"⚠️ Duplicate note, bumping importance (user={uname}): {text}")
-            _save_memory(username)
-            return
-
-    note_type, tags, importance = _classify_note(text)
-
-    emb = _get_embedding(text)
-    index.add(np.array([emb]))
-
-    item = MemoryItem(
-        text=text,
-        type=note_type,
-        tags=tags,
-        importance=importance,
-        source_msg=source_message,
-        created_at=created_at,
-    )
-    items.append(item)
-    print(f"✅ Stored memory note for user={uname}: {item.text}  (type={item.type}, importance={item.importance})")
-    _save_memory(username)
+    known = labels or {}
+    unlabeled = [t for t in new_texts if t not in known]
+    # Independent I/O-bound chat calls -> fan out; one note needs no pool
+    if len(unlabeled) == 1:
+        fresh = [_classify_note(unlabeled[0])]
+    elif unlabeled:
+        with ThreadPoolExecutor(max_workers=min(CLASSIFY_MAX_WORKERS, len(unlabeled))) as ex:
+            fresh = list(ex.map(_classify_note, unlabeled))
+    else:
+        fresh = []
+    known = {**known, **dict(zip(unlabeled, fresh))}
+
+    embs = embed_batch(new_texts)
+
+    # classify + embed ran unlocked; FAISS ids = positions in items, so the
+    # add and the appends happen together under the lock
+    with _user_lock(uname):
+        # another request may have stored some of these in the meantime
+        fresh_rows = [
+            (text, emb) for text, emb in zip(new_texts, embs)
+            if not _bump_duplicate(uname, _dedup_key(text), text, 1 + repeats[_dedup_key(text)])
+        ]
+        if fresh_rows:
+            index = _writable_index(uname)
+            index.add(_unit_rows([emb for _, emb in fresh_rows]))
+
+        for text, _ in fresh_rows:
+            note_type, tags, importance = known[text]
+            extra = repeats[_dedup_key(text)]
+            if extra:
+                importance = min(3, importance + extra)
+                print(f"⚠️ Duplicate note, bumping importance (user={uname}): {text}")
+            item = MemoryItem(
+                text=text,
+                type=note_type,
+                tags=tags,
+                importance=importance,
+                source_msg=source_message,
+                created_at=created_at,
+            )
+            items.append(item)
+            lookup.setdefault(_dedup_key(text), len(items) - 1)
+            print(f"✅ Stored memory note for user={uname}: {item.text}  (type={item.type}, importance={item.importance})")
+        _mark_dirty(uname)
+
+
+def _bump_duplicate(uname: str, key: str, text: str, times: int = 1) -> bool:
+    """
+    If this note is already stored, bump its importance (once per copy,
+    capped at 3) and return True. Caller holds _user_lock(uname).
+    """
+    dup_pos = _user_text_lookup[uname].get(key)
+    if dup_pos is None:
+        return False
+    item = _user_memory_items[uname][dup_pos]
+    item.importance = min(3, item.importance + times)
+    print(f"⚠️ Duplicate note, bumping importance (user={uname}): {text}")
+    return True
 
 
-def retrieve_related(query: str, top_k: int = 3, username: Optional[str] = None) -> List[str]:
+def retrieve_related(
+    query: str,
+    top_k: int = 3,
+    username: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+) -> List[str]:
     """
     Semantic search over stored user notes for this user.
     Returns the "text" field of the most related notes.
+    `types`: only consider notes of these types (e.g. ["concern", "goal"]).
     """
-    items, index, _ = _get_store(username)
+    items, _, _ = _get_store(username)
 
     if len(items) == 0:
         return []
@@ -614,14 +1078,89 @@ def retrieve_related(query: str, top_k: int = 3, username: Optional[str] = None)
     if not query:
         return []
 
-    qvec = _get_embedding(query)
-    D, I = index.search(np.array([qvec]), min(top_k, len(items)))
+    qvec = embed_batch([query])[0]
+    return fetch_memory_with_embedding(qvec, top_k, username=username, types=types)
+
+
+def retrieve_related_batch(
+    queries: List[str],
+    top_k: int = 3,
+    username: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+) -> List[List[str]]:
+    """
+    retrieve_related for many queries at once: one embeddings call and one
+    (nq, D) FAISS search, instead of nq of each. Results in query order.
+    """
+    items, _, _ = _get_store(username)
+    cleaned = [(q or "").strip() for q in queries]
+    live = [q for q in cleaned if q]
+    if len(items) == 0 or not live:
+        return [[] for _ in queries]
+
+    found = iter(fetch_memory_with_embeddings(embed_batch(live), top_k, username, types))
+    return [next(found) if q else [] for q in cleaned]
+
+
+def fetch_memory_with_embedding(
+    qvec: np.ndarray,
+    top_k: int = 3,
+    username: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+) -> List[str]:
+    """
+    Same search as retrieve_related, for a query vector the caller already has
+    (e.g. the semantic cache embedded this turn's text) - no embedding call.
+    """
+    return fetch_memory_with_embeddings([qvec], top_k, username, types)[0]
+
+
+def fetch_memory_with_embeddings(
+    qvecs: Sequence[np.ndarray],
+    top_k: int = 3,
+    username: Optional[str] = None,
+    types: Optional[Sequence[str]] = None,
+) -> List[List[str]]:
+    """
+    Batch form of fetch_memory_with_embedding: one search call for all rows.
+    """
+    _, _, uname = _get_store(username)
+    with _user_lock(uname):
+        return _search_locked(uname, qvecs, top_k, types)
+
+
+def _search_locked(
+    uname: str,
+    qvecs: Sequence[np.ndarray],
+    top_k: int,
+    types: Optional[Sequence[str]],
+) -> List[List[str]]:
+    items, index = _user_memory_items[uname], _user_faiss_index[uname]
+
+    if len(items) == 0:
+        return [[] for _ in qvecs]
+
+    # Type filter runs inside the FAISS scan (ids = positions in items),
+    # so top_k counts only allowed notes - no over-fetch + Python filter.
+    params = None
+    k = min(top_k, len(items))
+    if types is not None:
+        allowed = _positions_of_types(uname, types)
+        if allowed.size == 0:
+            return [[] for _ in qvecs]
+        sel = faiss.IDSelectorBatch(allowed)
+        if isinstance(index, faiss.IndexIVF):
+            # filtered notes may sit outside the usual nprobe lists -> probe all
+            params = faiss.SearchParametersIVF(sel=sel, nprobe=index.nlist)
+        else:
+            params = faiss.SearchParameters(sel=sel)
+        k = min(k, int(allowed.size))
+
+    # One FAISS exhaustive scan over the whole (N, D) fp16 matrix, no Python loop.
+    # Inner product of unit vectors: larger D = more similar, best first.
+    D, I = index.search(_unit_rows(qvecs), k, params=params)
 
-    result: List[str] = []
-    for idx in I[0]:
-        if 0 <= idx < len(items):
-            result.append(items[idx].text)
-    return result
+    return [[items[idx].text for idx in row if 0 <= idx < len(items)] for row in I]
 
 
 def fetch_memory(query: str, top_k: int = 3, username: Optional[str] = None) -> List[str]:
@@ -631,6 +1170,22 @@ def fetch_memory(query: str, top_k: int = 3, username: Optional[str] = None) ->
     return retrieve_related(query, top_k, username=username)
 
 
+async def fetch_memory_async(
+    query: str,
+    top_k: int = 3,
+    username: Optional[str] = None,
+    embedding: Optional[np.ndarray] = None,
+) -> List[str]:
+    """
+    Same as fetch_memory, but runs the embedding + FAISS search in a worker
+    thread so callers can overlap it with other work (state update, prompt build).
+    With `embedding` given, only the search runs (no embedding lookup at all).
+    """
+    if embedding is not None:
+        return await asyncio.to_thread(fetch_memory_with_embedding, embedding, top_k, username)
+    return await asyncio.to_thread(fetch_memory, query, top_k, username)
+
+
 def get_all_memory_notes(username: Optional[str] = None) -> List[str]:
     """
     For debug / UI panel – only note texts.
@@ -647,6 +1202,38 @@ def get_structured_memory(username: Optional[str] = None) -> List[Dict[str, Any]
     return [asdict(m) for m in items]
 
 
+# type -> weight multiplier on importance; any other type counts a flat 1
+_RELATIONSHIP_TYPE_WEIGHTS = {
+    "relationship": 3,
+    "relationship_state": 3,
+    "goal": 2,
+    "concern": 2,
+}
+
+
+def relationship_score(username: Optional[str] = None) -> int:
+    """
+    How much the user has shared: sum over notes of weight * importance for
+    relationship/goal/concern notes, 1 per other note (see state_engine).
+    Vectorized over the column view, and remembered until the user's notes
+    change (state_engine asks on every turn; notes change far less often).
+    """
+    items, _, uname = _get_store(username)
+    if not items:
+        return 0
+    score = _user_rel_scores.get(uname)
+    if score is None:
+        with _user_lock(uname):
+            cols = _columns(uname)
+            by_code = {_type_code(t): w for t, w in _RELATIONSHIP_TYPE_WEIGHTS.items()}
+            weights = np.zeros(len(_TYPE_CODES), dtype="int64")
+            weights[list(by_code)] = list(by_code.values())
+            w = weights[cols.types]
+            score = int(np.where(w > 0, w * cols.importance, 1).sum())
+            _user_rel_scores[uname] = score
+    return score
+
+
 def get_memory_count(username: Optional[str] = None) -> int:
     items, _, _ = _get_store(username)
     return len(items)
@@ -668,16 +1255,22 @@ def maybe_store_user_message(
     Called once per user message.
 
     Pipeline:
-      1) Fast cleaning & length check.
+      1) Fast cleaning, length check and first-person pre-filter.
       2) Analyzer LLM decides if it should be stored + why.
       3) Local heuristics force storage for obvious important cases.
-      4) If final decision is "store", call extract_user_notes().
-      5) For each extracted note, call store_memory().
+      4) If final decision is "store", call extract_classified_notes()
+         (notes come back typed + tagged + scored from that one call).
+      5) Batch-embed the message + all notes in one API call.
+      6) Store all extracted notes with store_memories().
     """
     cleaned = (text or "").strip()
     if not cleaned or len(cleaned) < 3:
         return
 
+    # Microsecond pre-filter: nothing about the user -> no analyzer/extractor calls
+    if not _has_self_signal(cleaned):
+        return
+
     # 1) Ask the analyzer LLM
     analysis = _analyze_message_for_memory(cleaned)
     should_store_llm = bool(analysis.get("should_store", False))
@@ -706,23 +1299,38 @@ def maybe_store_user_message(
         print(f"🗑️ Not storing message (user={_sanitize_username(username)}): {cleaned!r}  reason={analysis.get('reason')}")
         return
 
-    # 4) Extract structured notes
+    # 4) Extract structured notes (already classified)
     try:
-        notes = extract_user_notes(cleaned)
+        extracted = extract_classified_notes(cleaned)
     except Exception as e:
-        print("⚠️ Error in extract_user_notes:", e)
+        print("⚠️ Error in extract_classified_notes:", e)
         return
 
+    notes = [n["text"] for n in extracted]
+    labels = {
+        n["text"]: (n["type"], n["tags"], n["importance"]) for n in extracted if "type" in n
+    }
+
     if not notes:
         print(f"⚠️ Analyzer wanted to store, but extractor returned no notes for (user={_sanitize_username(username)}): {cleaned!r}")
         return
 
-    # 5) Store each note
-    for note in notes:
-        try:
-            store_memory(note, source_message=cleaned, created_at=msg_index, username=username)
-        except Exception as e:
-            print("⚠️ Error storing note:", note, e)
+    # 5) One batched embedding round-trip for the message (used later by
+    #    the reply cache / memory fetch) plus every note we're about to store
+    try:
+        embed_batch([cleaned] + [n.strip() for n in notes if n.strip()])
+    except Exception as e:
+        print("⚠️ Error in embed_batch:", e)
+
+    # 6) Store all notes together (one FAISS add), then one save for the
+    #    whole message
+    try:
+        store_memories(
+            notes, source_message=cleaned, created_at=msg_index, username=username, labels=labels
+        )
+    except Exception as e:
+        print("⚠️ Error storing notes:", notes, e)
+    flush_memory(username)
 
 
 # ========= High-level Profile Summary (for research/UI) =========
@@ -742,12 +1350,10 @@ def summarize_user_profile(max_notes: int = 80, username: Optional[str] = None)
     if not items:
         return "no stable info about the user yet."
 
-    sorted_items = sorted(
-        items,
-        key=lambda m: m.importance,
-        reverse=True,
-    )
-    notes = [m.text for m in sorted_items[:max_notes]]
+    # most important first; stable, so equal importance keeps insertion order.
+    # (stable argsort on int8 is NumPy's radix sort: O(N), no comparison sort)
+    top = np.argsort(-_columns(uname).importance, kind="stable")[:max_notes]
+    notes = [items[i].text for i in top]
     joined = "\n".join(f"- {n}" for n in notes)
 
     system_prompt = """
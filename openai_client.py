@@ -0,0 +1,66 @@
+# openai_client.py
+from __future__ import annotations
+
+import importlib.util
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI, DefaultHttpxClient
+
+# ========= Shared OpenAI clients =========
+#
+# One keep-alive connection pool per flavour for the whole app:
+#   client       - sync, for code that runs in worker threads (memory_engine)
+#   async_client - async, for the reply pipeline awaited on the server's
+#                  event loop (brain.py). Its pool belongs to that one loop,
+#                  so never drive it through asyncio.run() from other threads.
+
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]");
+# without it we stay on HTTP/1.1 keep-alive.
+HTTP2_ENABLED = importlib.util.find_spec("h2") is not None
+
+# Room for bursts of concurrent users without re-handshaking; idle
+# connections kept for a minute so conversational gaps reuse them.
+_LIMITS = httpx.Limits(
+    max_connections=200,
+    max_keepalive_connections=100,
+    keepalive_expiry=60.0,
+)
+# Chat replies are short: fail fast on a dead connect instead of the
+# SDK's 10-minute default (read timeout applies per streamed chunk).
+_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+client = OpenAI(
+    http_client=DefaultHttpxClient(http2=HTTP2_ENABLED, limits=_LIMITS),
+    timeout=_TIMEOUT,
+)
+
+# max_retries=0: async calls are retried (with jitter) by openai_pool instead,
+# so 429s aren't retried twice by two stacked layers.
+async_client = AsyncOpenAI(
+    http_client=DefaultAsyncHttpxClient(http2=HTTP2_ENABLED, limits=_LIMITS),
+    timeout=_TIMEOUT,
+    max_retries=0,
+)
+
+
+def warm_up() -> None:
+    """
+    Pay the TCP + TLS handshake at startup instead of on the first user turn.
+    Failures are only logged: the app still works, just with a cold first call.
+    """
+    try:
+        client.models.list()
+        print(f"🔥 OpenAI connection warmed (http2={HTTP2_ENABLED}).")
+    except Exception as e:
+        print("⚠️ OpenAI warm-up failed:", e)
+
+
+async def warm_up_async() -> None:
+    """
+    Same as warm_up, for async_client. Must run on the serving event loop.
+    """
+    try:
+        await async_client.models.list()
+        print(f"🔥 OpenAI async connection warmed (http2={HTTP2_ENABLED}).")
+    except Exception as e:
+        print("⚠️ OpenAI async warm-up failed:", e)
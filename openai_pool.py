@@ -0,0 +1,146 @@
+# openai_pool.py
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import openai
+
+# ========= Rate-limit-aware OpenAI request pool =========
+#
+# Every async OpenAI call from the reply pipeline goes through `pool.submit`:
+#   - a global concurrency cap (asyncio.Semaphore)
+#   - request-per-minute and token-per-minute budgets (token buckets)
+#   - retry with exponential backoff + full jitter on 429 / transient errors
+# so a burst of users queues briefly at the RPM/TPM ceiling instead of
+# crashing into RateLimitError.
+
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+MAX_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_MAX_RPM", "500"))
+MAX_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_MAX_TPM", "200000"))
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+_RETRYABLE = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+T = TypeVar("T")
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_completion_tokens: int) -> int:
+    """
+    Rough TPM charge for one chat call: ~4 chars per prompt token + the
+    completion budget (OpenAI counts max_completion_tokens against TPM too).
+    """
+    prompt_chars = sum(len(m.get("content") or "") for m in messages)
+    return prompt_chars // 4 + max_completion_tokens
+
+
+class _TokenBucket:
+    """
+    `per_minute` capacity, refilled continuously. Refill is computed lazily
+    from the clock on each check, so no background task is needed.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class OpenAIPool:
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_requests_per_minute: float = MAX_REQUESTS_PER_MINUTE,
+        max_tokens_per_minute: float = MAX_TOKENS_PER_MINUTE,
+    ):
+        self.max_concurrency = max_concurrency
+        self._requests = _TokenBucket(max_requests_per_minute)
+        self._tokens = _TokenBucket(max_tokens_per_minute)
+        # asyncio primitives belong to one loop; (re)made for the running loop
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._budget_lock: Optional[asyncio.Lock] = None
+
+    def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._budget_lock = asyncio.Lock()
+
+    async def _reserve(self, est_tokens: int) -> None:
+        """
+        Wait until both budgets can pay for this call, then charge them.
+        The lock keeps waiters FIFO so big calls don't starve.
+        """
+        async with self._budget_lock:
+            while True:
+                wait = max(
+                    self._requests.seconds_until(1),
+                    self._tokens.seconds_until(est_tokens),
+                )
+                if wait <= 0:
+                    self._requests.take(1)
+                    self._tokens.take(est_tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    async def submit(
+        self,
+        create: Callable[..., Awaitable[T]],
+        *,
+        est_tokens: int,
+        **kwargs: Any,
+    ) -> T:
+        """
+        Run `await create(**kwargs)` under the concurrency cap and budgets.
+
+        For stream=True calls this returns the stream once the response has
+        started; the slot is released then, not when the stream is drained.
+        """
+        self._bind()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._reserve(est_tokens)
+            async with self._sem:
+                try:
+                    return await create(**kwargs)
+                except _RETRYABLE as e:
+                    if attempt == MAX_ATTEMPTS:
+                        raise
+                    cap = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+                    delay = random.uniform(0, cap)
+                    print(
+                        f"⏳ OpenAI {type(e).__name__}, retry {attempt}/{MAX_ATTEMPTS - 1} "
+                        f"in {delay:.2f}s"
+                    )
+            await asyncio.sleep(delay)
+
+
+pool = OpenAIPool()
@@ -1,4 +1,9 @@
 # persona.py
+from functools import lru_cache
+
+# Bump after editing persona_profile at runtime, so cached prompt text
+# (here and in brain.py's static prefix) is rebuilt.
+PERSONA_VERSION = 0
 
 persona_profile = {
     "name": "Emily",
@@ -33,6 +38,11 @@ persona_profile = {
 
 
 def get_persona_context() -> str:
+    return _persona_context(PERSONA_VERSION)
+
+
+@lru_cache(maxsize=4)
+def _persona_context(version: int) -> str:
     likes = ", ".join(persona_profile["likes"])
     dislikes = ", ".join(persona_profile["dislikes"])
     vibe = ", ".join(persona_profile["vibe"])
@@ -0,0 +1,251 @@
+# semantic_cache.py
+from __future__ import annotations
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import islice
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Iterator, Sequence, Tuple
+
+import numpy as np
+
+import memory_engine
+import state_engine
+
+# ========= Semantic response cache =========
+#
+# Near-duplicate user turns ("hi", "hey", "lol") in the same conversational
+# context get the previously generated reply back without any chat call.
+# Rows are namespaced per username and expire after CACHE_TTL_SECONDS so the
+# persona doesn't keep replaying stale answers.
+#
+# SQLite is the persistent store; lookups are served from an in-process LRU
+# mirror (one small normalized matrix per namespace + context), so a turn
+# costs one matmul and no disk read once its context is hot.
+
+CACHE_FILE = memory_engine.MEMORY_DIR / "semantic_cache.sqlite3"
+
+SIMILARITY_THRESHOLD = 0.92
+CACHE_TTL_SECONDS = 6 * 60 * 60
+HISTORY_TURNS = 2
+MAX_ENTRIES = 10_000   # in-memory mirror size (rows), LRU-evicted by context
+
+
+@dataclass
+class CacheQuery:
+    """
+    Everything needed to look up / store one user turn.
+
+    namespace:
+        normalized username (cache is per-user)
+
+    context_hash:
+        sha256 of the prompt mode + relationship stage + the last
+        HISTORY_TURNS messages before this turn
+
+    embedding:
+        L2-normalized float32 embedding of the user text
+    """
+    namespace: str
+    context_hash: str
+    embedding: np.ndarray
+
+
+@contextmanager
+def _db() -> Iterator[sqlite3.Connection]:
+    """
+    Short-lived connection per operation (safe across the threadpool workers
+    FastAPI runs blocking handlers and run_in_threadpool calls on).
+    Commits on success, always closes.
+    """
+    conn = sqlite3.connect(str(CACHE_FILE))
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS reply_cache (
+            namespace    TEXT NOT NULL,
+            context_hash TEXT NOT NULL,
+            embedding    BLOB NOT NULL,
+            reply        TEXT NOT NULL,
+            ts           INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reply_cache_key "
+        "ON reply_cache (namespace, context_hash)"
+    )
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _conversation_mode() -> str:
+    """
+    The parts of conversation state that change what Emily would say:
+    stranger vs existing-friend prompt mode, and relationship stage.
+    """
+    mode = "existing" if memory_engine.has_any_memory() else "new_user"
+    return f"{mode}/{state_engine.snapshot().rel_stage}"
+
+
+def _context_hash(history: Sequence[Dict[str, Any]], mode: str = "") -> str:
+    """
+    Hash of the conversation mode + last few turns, so "lol" after a joke and
+    "lol" after bad news (or to a stranger vs a friend) don't share a reply.
+    """
+    # history may be the app's deque (no slicing) -> walk from the right end
+    tail = list(islice(reversed(history), HISTORY_TURNS))[::-1]
+    joined = "\n".join(f"{m.get('sender')}: {m.get('text', '')}" for m in tail)
+    return hashlib.sha256(f"{mode}\n{joined}".encode("utf8")).hexdigest()
+
+
+def make_query(
+    text: str,
+    history: Sequence[Dict[str, Any]],
+    username: Optional[str] = None,
+) -> CacheQuery:
+    """
+    Embed the user text once; the same query is used for lookup and store.
+    `history` is the chat history BEFORE this user turn.
+    """
+    emb = memory_engine._get_embedding(text)
+    norm = float(np.linalg.norm(emb))
+    if norm > 0:
+        emb = emb / norm
+    return CacheQuery(
+        namespace=memory_engine._sanitize_username(username),
+        context_hash=_context_hash(history or [], _conversation_mode()),
+        embedding=emb.astype("float32"),
+    )
+
+
+# ========= In-memory LRU mirror =========
+
+@dataclass(frozen=True)
+class _Bucket:
+    """
+    All cached rows for one (namespace, context_hash). Replaced, never mutated,
+    so readers can use a bucket outside the lock.
+    """
+    matrix: np.ndarray    # (n, EMBED_DIM) float32, L2-normalized rows
+    replies: List[str]
+    ts: np.ndarray        # (n,) int64 insert times
+
+    @property
+    def size(self) -> int:
+        # empty buckets still hold an LRU slot
+        return max(1, len(self.replies))
+
+
+_hot: "OrderedDict[Tuple[str, str], _Bucket]" = OrderedDict()
+_hot_rows = 0
+_hot_lock = threading.Lock()
+
+
+def _load_bucket(key: Tuple[str, str], min_ts: int) -> _Bucket:
+    with _db() as conn:
+        rows = conn.execute(
+            "SELECT embedding, reply, ts FROM reply_cache "
+            "WHERE namespace = ? AND context_hash = ? AND ts >= ?",
+            (key[0], key[1], min_ts),
+        ).fetchall()
+
+    if not rows:
+        return _Bucket(
+            matrix=np.empty((0, memory_engine.EMBED_DIM), dtype="float32"),
+            replies=[],
+            ts=np.empty(0, dtype="int64"),
+        )
+    return _Bucket(
+        matrix=np.stack([np.frombuffer(blob, dtype="float32") for blob, _, _ in rows]),
+        replies=[reply for _, reply, _ in rows],
+        ts=np.array([ts for _, _, ts in rows], dtype="int64"),
+    )
+
+
+def _put_bucket(key: Tuple[str, str], bucket: _Bucket) -> None:
+    """Insert/replace under _hot_lock, then evict least recently used contexts."""
+    global _hot_rows
+    old = _hot.pop(key, None)
+    if old is not None:
+        _hot_rows -= old.size
+    _hot[key] = bucket
+    _hot_rows += bucket.size
+    while _hot_rows > MAX_ENTRIES and len(_hot) > 1:
+        _, evicted = _hot.popitem(last=False)
+        _hot_rows -= evicted.size
+
+
+def _get_bucket(key: Tuple[str, str], min_ts: int) -> _Bucket:
+    with _hot_lock:
+        bucket = _hot.get(key)
+        if bucket is not None:
+            _hot.move_to_end(key)
+            return bucket
+
+    bucket = _load_bucket(key, min_ts)
+    with _hot_lock:
+        # another thread may have filled it meanwhile; keep theirs
+        existing = _hot.get(key)
+        if existing is not None:
+            _hot.move_to_end(key)
+            return existing
+        _put_bucket(key, bucket)
+    return bucket
+
+
+def lookup(query: CacheQuery) -> Optional[str]:
+    """
+    Cosine top-1 over non-expired rows with the same namespace + context.
+    Returns the cached reply if similarity > SIMILARITY_THRESHOLD.
+    """
+    min_ts = int(time.time()) - CACHE_TTL_SECONDS
+    bucket = _get_bucket((query.namespace, query.context_hash), min_ts)
+    if not bucket.replies:
+        return None
+
+    sims = bucket.matrix @ query.embedding
+    sims[bucket.ts < min_ts] = -1.0
+    best = int(np.argmax(sims))
+    if float(sims[best]) > SIMILARITY_THRESHOLD:
+        return bucket.replies[best]
+    return None
+
+
+def store(query: CacheQuery, reply: str) -> None:
+    """
+    Insert (embedding, reply, now) and drop expired rows.
+    """
+    reply = (reply or "").strip()
+    if not reply:
+        return
+
+    now = int(time.time())
+    with _db() as conn:
+        conn.execute(
+            "INSERT INTO reply_cache (namespace, context_hash, embedding, reply, ts) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (query.namespace, query.context_hash, query.embedding.tobytes(), reply, now),
+        )
+        conn.execute(
+            "DELETE FROM reply_cache WHERE ts < ?",
+            (now - CACHE_TTL_SECONDS,),
+        )
+
+    # keep the mirror in sync if this context is hot (cold ones load from SQLite)
+    key = (query.namespace, query.context_hash)
+    with _hot_lock:
+        bucket = _hot.get(key)
+        if bucket is not None:
+            live = bucket.ts >= now - CACHE_TTL_SECONDS
+            _put_bucket(key, _Bucket(
+                matrix=np.vstack([bucket.matrix[live], query.embedding[None, :]]),
+                replies=[r for r, keep in zip(bucket.replies, live) if keep] + [reply],
+                ts=np.append(bucket.ts[live], now),
+            ))
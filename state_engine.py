@@ -1,15 +1,25 @@
 # state_engine.py
 from __future__ import annotations
 from typing import Dict, Any, Optional, List
+from collections import deque, namedtuple
+from functools import lru_cache
 from pathlib import Path
-import json
+import atexit
+import queue
+import threading
 import time
-import random
+
+import orjson
 
 import memory_engine
+from keyword_scan import KeywordScanner
 
 # ========= Conversation State =========
 
+# Caps on the per-conversation lists (the state log serializes them each turn)
+MAX_OPEN_LOOPS = 64
+MAX_CONCERNS = 64
+
 conversation_state: Dict[str, Any] = {
     # Social bonding
     "relationship_stage": "stranger",   # "stranger" | "getting_to_know" | "friend" | "close_friend"
@@ -28,88 +38,179 @@ conversation_state: Dict[str, Any] = {
     "user_engagement": 50,              # 0–100 estimate of how engaged the user is
 
     # Future references
-    "open_loops": [],                   # raw text about future stuff ("next week", "tomorrow")
+    "open_loops": deque(maxlen=MAX_OPEN_LOOPS),  # newest kept; raw text about future stuff ("next week", "tomorrow")
 
     # concern tracker list: each = {"type", "text", "created_at", "last_asked_at", "resolved", "severity"}
     "concerns": [],
 
     # multi-message story buffering
     "story_buffer_active": False,
-    "story_buffer": "",
+    "story_buffer": [],                 # chunks so far; read as one string via get_state_copy
 }
 
 STATE_LOG = Path("state_log.jsonl")  # for research / analysis
 
+# Bumped whenever one of these growing lists (or an item in it) changes,
+# so the state log re-serializes it only then (see _state_json).
+_list_versions: Dict[str, int] = {"open_loops": 0, "concerns": 0}
+
+
+def _touch(key: str) -> None:
+    _list_versions[key] += 1
+
 
 def get_state_copy() -> Dict[str, Any]:
-    return dict(conversation_state)
+    state = dict(conversation_state)
+    state["open_loops"] = list(state["open_loops"])
+    state["story_buffer"] = " ".join(state["story_buffer"])
+    return state
+
+
+# Read-only view of the fields the brain reads every turn.
+StateSnap = namedtuple(
+    "StateSnap",
+    "ai_energy ai_trust user_mood rel_stage ai_mood privacy_refusal",
+)
+
+
+def snapshot() -> StateSnap:
+    """
+    Frozen per-turn snapshot of the hot state fields (one dict walk,
+    then cheap tuple attribute reads for the rest of the turn).
+    """
+    st = conversation_state
+    return StateSnap(
+        ai_energy=st.get("ai_energy", 70),
+        ai_trust=st.get("ai_trust_level", 10),
+        user_mood=st.get("user_mood", "neutral"),
+        rel_stage=st.get("relationship_stage", "stranger"),
+        ai_mood=st.get("ai_mood", "chill"),
+        privacy_refusal=st.get("privacy_refusal", False),
+    )
+
+
+# ---------- Keyword tables (one scan per message) ----------
+#
+# Every lexical cue below, tagged by what it signals. The state update scans
+# the lowercased text once (_scan) and each rule just checks its tag.
+
+_KEYWORDS: Dict[str, List[str]] = {
+    # emoji / symbol cues (strong signal, checked before words)
+    "emoji:sad": ["😭", "😢", "💔", "🥹"],
+    "emoji:happy": ["😂", "🤣", "😆", "😹"],
+    "emoji:angry": ["😡", "🤬", "😤"],
+    "emoji:tired": ["😴", "🥱", "💤"],
+    # lexical mood cues
+    "mood:sad": ["sad", "depressed", "down", "upset", "lonely", "cry"],
+    "mood:stressed": ["stressed", "overwhelmed", "anxious", "anxiety", "panic"],
+    "mood:angry": ["angry", "pissed", "mad", "furious", "irritated"],
+    "mood:happy": ["excited", "hyped", "happy", "good", "great", "awesome", "loving it"],
+    "mood:tired": ["tired", "exhausted", "sleepy", "drained", "worn out"],
+    "privacy": [
+        "don't want to share",
+        "dont want to share",
+        "don't wanna share",
+        "dont wanna share",
+        "private information",
+        "too private",
+        "not comfortable sharing",
+        "none of your business",
+    ],
+    "open_loop": ["next week", "tomorrow", "soon", "next month"],
+    "energy:up": ["haha", "lol", "lmao", "love this", "this is nice", "that's nice", "thats nice"],
+    "trust:down": ["stupid", "dumb", "hate you", "annoying", "useless"],
+    "concern:health": ["i'm sick", "im sick", "not feeling well", "feeling sick", "got sick"],
+    "concern:exam": ["exam", "test"],
+    "concern:interview": ["interview", "job interview"],
+    "concern:relationship": ["breakup", "broke up", "relationship ended"],
+    "concern:general_worry": [
+        "worried",
+        "worry",
+        "don't know what to do",
+        "dont know what to do",
+        "lost about my life",
+        "lost in life",
+    ],
+    "severity:3": ["really scared", "panic", "freaking out", "can't sleep", "cant sleep", "very worried"],
+    "severity:2": ["worried", "nervous", "stressed", "anxious"],
+    "resolved:health": ["i'm better", "im better", "feeling better", "much better now"],
+}
+
+_SCANNER = KeywordScanner(_KEYWORDS)
+
+# checked in this order; first hit wins
+_MOOD_RULES = [
+    ("emoji:sad", "sad"),
+    ("emoji:happy", "happy"),
+    ("emoji:angry", "angry"),
+    ("emoji:tired", "tired"),
+    ("mood:sad", "sad"),
+    ("mood:stressed", "stressed"),
+    ("mood:angry", "angry"),
+    ("mood:happy", "happy"),
+    ("mood:tired", "tired"),
+]
+# (scanner tag, concern type), in registration order
+_CONCERN_TAGS = tuple(
+    (f"concern:{ctype}", ctype)
+    for ctype in ("health", "exam", "interview", "relationship", "general_worry")
+)
+
+
+def _scan(text: str) -> frozenset:
+    """Tags from _KEYWORDS present in text (case-insensitive)."""
+    return _scan_lower((text or "").lower())
+
+
+# Short acks and greetings ("lol", "ok", "haha") recur constantly; the tag
+# set is a pure function of the lowercased text, so remember recent ones.
+# Every mood / privacy / concern rule reads from this one result.
+@lru_cache(maxsize=4096)
+def _scan_lower(t: str) -> frozenset:
+    return _SCANNER.scan(t)
 
 
 # ---------- Mood detection (lexical + emoji) ----------
 
-def detect_user_mood(text: str) -> str:
+def detect_user_mood(text: str, hits: Optional[frozenset] = None) -> str:
     """
     Lightweight, deterministic mood classifier based on:
     - emojis / symbols
     - affective keywords
+    `hits`: precomputed _scan(text), when the caller already has it.
     """
-    t = (text or "").strip()
-    tl = t.lower()
-
-    # Emoji / symbol cues first (strong signal)
-    if any(e in t for e in ["😭", "😢", "💔", "🥹"]):
-        return "sad"
-    if any(e in t for e in ["😂", "🤣", "😆", "😹"]):
-        return "happy"
-    if any(e in t for e in ["😡", "🤬", "😤"]):
-        return "angry"
-    if any(e in t for e in ["😴", "🥱", "💤"]):
-        return "tired"
-
-    # Lexical cues
-    if any(w in tl for w in ["sad", "depressed", "down", "upset", "lonely", "cry"]):
-        return "sad"
-    if any(w in tl for w in ["stressed", "overwhelmed", "anxious", "anxiety", "panic"]):
-        return "stressed"
-    if any(w in tl for w in ["angry", "pissed", "mad", "furious", "irritated"]):
-        return "angry"
-    if any(w in tl for w in ["excited", "hyped", "happy", "good", "great", "awesome", "loving it"]):
-        return "happy"
-    if any(w in tl for w in ["tired", "exhausted", "sleepy", "drained", "worn out"]):
-        return "tired"
-
+    if hits is None:
+        hits = _scan(text)
+    for tag, mood in _MOOD_RULES:
+        if tag in hits:
+            return mood
     return "neutral"
 
 
+# user mood -> ai mood; anything else (neutral) stays "chill"
+_AI_MOOD_FOR = {
+    "sad": "supportive",
+    "stressed": "supportive",
+    "angry": "supportive",
+    "tired": "supportive",
+    "happy": "playful",
+}
+
+
 def update_ai_mood(user_mood: str) -> str:
     """
     Simple policy: mirror negative affect with supportive tone,
     mirror positive affect with playful tone, otherwise stay chill.
     """
-    if user_mood in ["sad", "stressed", "angry", "tired"]:
-        return "supportive"
-    if user_mood == "happy":
-        return "playful"
-    return "chill"
+    return _AI_MOOD_FOR.get(user_mood, "chill")
 
 
 # ---------- Privacy / boundaries ----------
 
-def wants_privacy(text: str) -> bool:
-    t = text.lower()
-    return any(
-        phrase in t
-        for phrase in [
-            "don't want to share",
-            "dont want to share",
-            "don't wanna share",
-            "dont wanna share",
-            "private information",
-            "too private",
-            "not comfortable sharing",
-            "none of your business",
-        ]
-    )
+def wants_privacy(text: str, hits: Optional[frozenset] = None) -> bool:
+    if hits is None:
+        hits = _scan(text)
+    return "privacy" in hits
 
 
 # ---------- Relationship state (based on structured memory) ----------
@@ -120,22 +221,10 @@ def update_relationship_stage():
     Relationship-related memories and high-importance items count more.
     """
     try:
-        items = memory_engine.get_structured_memory()
+        score = memory_engine.relationship_score()
     except Exception as e:
         print("⚠️ failed to read structured memory in update_relationship_stage:", e)
-        items = []
-
-    score = 0
-    for m in items:
-        mtype = (m.get("type") or "").lower()
-        imp = int(m.get("importance", 1))
-
-        if mtype in ["relationship", "relationship_state"]:
-            score += 3 * imp
-        elif mtype in ["goal", "concern"]:
-            score += 2 * imp
-        else:
-            score += 1
+        score = 0
 
     if score == 0:
         stage = "stranger"
@@ -151,68 +240,81 @@ def update_relationship_stage():
 
 # ---------- Curiosity / deeper questions ----------
 
+# Deeper questions fire on 3 of every 20 eligible turns (15%), spread evenly
+# by an integer accumulator instead of an RNG draw: same long-run rate,
+# reproducible state logs.
+_DEEP_Q_HITS, _DEEP_Q_PERIOD = 3, 20
+_deep_q_accum = 0
+_DEEP_Q_STAGES = frozenset({"friend", "close_friend"})
+
+
 def should_ask_deeper_question() -> bool:
     """
-    Decide probabilistically whether to ask a deeper question.
+    Decide whether to ask a deeper question.
 
     Conditions:
     - Only in "friend" or "close_friend".
     - After at least a few turns.
     - Trust and energy must be above thresholds.
-    - Then ~15% chance per eligible turn.
+    - Then 15% of eligible turns (deterministic schedule).
     """
-    n = conversation_state["message_count"]
-    stage = conversation_state["relationship_stage"]
-    trust = conversation_state["ai_trust_level"]
-    energy = conversation_state["ai_energy"]
+    global _deep_q_accum
 
-    if stage not in ["friend", "close_friend"]:
+    # most turns fail the stage check; read each field only when needed
+    cs = conversation_state
+    if cs["relationship_stage"] not in _DEEP_Q_STAGES:
         return False
-    if n < 5:
+    if cs["message_count"] < 5:
         return False
-    if trust < 30 or energy < 40:
+    if cs["ai_trust_level"] < 30 or cs["ai_energy"] < 40:
         return False
 
-    # probabilistic trigger; deterministic enough for stats, non-robotic in feel
-    return random.random() < 0.15
+    _deep_q_accum += _DEEP_Q_HITS
+    if _deep_q_accum >= _DEEP_Q_PERIOD:
+        _deep_q_accum -= _DEEP_Q_PERIOD
+        return True
+    return False
 
 
 # ---------- Open loops / follow-ups ----------
 
-def maybe_register_open_loop(text: str):
-    t = text.lower()
-    if "next week" in t or "tomorrow" in t or "soon" in t or "next month" in t:
+def maybe_register_open_loop(text: str, hits: Optional[frozenset] = None):
+    if hits is None:
+        hits = _scan(text)
+    if "open_loop" in hits:
         conversation_state["open_loops"].append(text.strip())
+        _touch("open_loops")
 
 
 # ---------- Energy / trust dynamics ----------
 
-def update_ai_energy_and_trust(user_text: str):
+def update_ai_energy_and_trust(user_text: str, hits: Optional[frozenset] = None):
     """
     Simple, interpretable dynamics:
     - Energy decays slowly every turn.
     - Positive reactions (lol, love this) increase energy + trust.
     - Hostile language decreases trust.
     """
+    # read once into locals, write back once at the end
+    cs = conversation_state
+    energy = cs["ai_energy"]
+    trust = cs["ai_trust_level"]
+
     # base decay
-    conversation_state["ai_energy"] = max(
-        30, conversation_state["ai_energy"] - 1
-    )
+    energy = max(30, energy - 1)
+
+    if hits is None:
+        hits = _scan(user_text)
 
-    t = user_text.lower()
+    if "energy:up" in hits:
+        energy = min(100, energy + 3)
+        trust = min(100, trust + 2)
 
-    if any(w in t for w in ["haha", "lol", "lmao", "love this", "this is nice", "that's nice", "thats nice"]):
-        conversation_state["ai_energy"] = min(
-            100, conversation_state["ai_energy"] + 3
-        )
-        conversation_state["ai_trust_level"] = min(
-            100, conversation_state["ai_trust_level"] + 2
-        )
+    if "trust:down" in hits:
+        trust = max(0, trust - 5)
 
-    if any(w in t for w in ["stupid", "dumb", "hate you", "annoying", "useless"]):
-        conversation_state["ai_trust_level"] = max(
-            0, conversation_state["ai_trust_level"] - 5
-        )
+    cs["ai_energy"] = energy
+    cs["ai_trust_level"] = trust
 
 
 # ---------- Engagement estimation ----------
@@ -243,7 +345,13 @@ def update_engagement_from_text(text: str):
 
 # ---------- Concern tracking (health, exams, etc.) ----------
 
-def scan_for_concerns(text: str):
+# type -> its unresolved concern dict (the same object as in
+# conversation_state["concerns"]), in registration order. There is at most
+# one open concern per type, so lookups and resolution skip the full list.
+_open_concerns: Dict[str, dict] = {}
+
+
+def scan_for_concerns(text: str, hits: Optional[frozenset] = None):
     """
     Scan user text for things the agent should FOLLOW UP on later.
     Examples:
@@ -252,58 +360,55 @@ def scan_for_concerns(text: str):
       - "my interview is next week"
       - "i'm worried about everything in life"
     """
-    t = text.lower()
+    if hits is None:
+        hits = _scan(text)
     msg_idx = conversation_state["message_count"]
 
-    if any(p in t for p in ["i'm sick", "im sick", "not feeling well", "feeling sick", "got sick"]):
-        _register_concern("health", text, msg_idx)
-    if "exam" in t or "test" in t:
-        _register_concern("exam", text, msg_idx)
-    if "interview" in t or "job interview" in t:
-        _register_concern("interview", text, msg_idx)
-    if any(p in t for p in ["breakup", "broke up", "relationship ended"]):
-        _register_concern("relationship", text, msg_idx)
-
-    # generic life worry / lost feeling
-    if (
-        "worried" in t
-        or "worry" in t
-        or "don't know what to do" in t
-        or "dont know what to do" in t
-        or "lost about my life" in t
-        or "lost in life" in t
-    ):
-        _register_concern("general_worry", text, msg_idx)
-
-
-def _register_concern(ctype: str, raw_text: str, msg_idx: int):
+    # (general_worry = generic life worry / lost feeling)
+    for tag, ctype in _CONCERN_TAGS:
+        if tag in hits:
+            _register_concern(ctype, text, msg_idx, hits)
+
+
+def _register_concern(ctype: str, raw_text: str, msg_idx: int, hits: Optional[frozenset] = None):
     """
     Add a concern if there isn't already an unresolved one of this type.
     Also mirror it into long-term memory as a 'concern' note with severity.
     """
-    for c in conversation_state["concerns"]:
-        if c["type"] == ctype and not c["resolved"]:
-            return
+    if ctype in _open_concerns:
+        return
 
-    t = raw_text.lower()
+    if hits is None:
+        hits = _scan(raw_text)
+    clean = raw_text.strip()
     severity = 1
-    if any(w in t for w in ["really scared", "panic", "freaking out", "can't sleep", "cant sleep", "very worried"]):
+    if "severity:3" in hits:
         severity = 3
-    elif any(w in t for w in ["worried", "nervous", "stressed", "anxious"]):
+    elif "severity:2" in hits:
         severity = 2
 
     concern = {
         "type": ctype,
-        "text": raw_text.strip(),
+        "text": clean,
         "created_at": msg_idx,
         "last_asked_at": None,
         "resolved": False,
         "severity": severity,
     }
-    conversation_state["concerns"].append(concern)
+    concerns = conversation_state["concerns"]
+    concerns.append(concern)
+    _open_concerns[ctype] = concern
+    if len(concerns) > MAX_CONCERNS:
+        # at most one open concern per type, so past the cap the oldest
+        # resolved one always exists; open concerns are never dropped
+        for i, c in enumerate(concerns):
+            if c["resolved"]:
+                del concerns[i]
+                break
+    _touch("concerns")
 
     # Mirror into long-term memory
-    note = f"user has an ongoing concern about {ctype}: {raw_text.strip()}"
+    note = f"user has an ongoing concern about {ctype}: {clean}"
     try:
         memory_engine.store_memory(note, source_message=raw_text, created_at=msg_idx)
     except Exception as e:
@@ -321,18 +426,14 @@ def pick_concern_to_follow_up() -> Optional[dict]:
     best = None
     best_score = -1
 
-    for c in conversation_state["concerns"]:
-        if c["resolved"]:
-            continue
-
+    for c in _open_concerns.values():
         age = msg_idx - c["created_at"]
         if age < 3:
             continue
 
-        if c["last_asked_at"] is not None:
-            since = msg_idx - c["last_asked_at"]
-            if since < 8:
-                continue
+        last_asked = c["last_asked_at"]
+        if last_asked is not None and msg_idx - last_asked < 8:
+            continue
 
         score = age + 3 * c.get("severity", 1)
         if score > best_score:
@@ -346,18 +447,21 @@ def mark_concern_asked(concern: Optional[dict]):
     if concern is None:
         return
     concern["last_asked_at"] = conversation_state["message_count"]
+    _touch("concerns")
 
 
-def maybe_mark_concerns_resolved(user_text: str):
+def maybe_mark_concerns_resolved(user_text: str, hits: Optional[frozenset] = None):
     """
     If user says they are better, mark health concerns resolved.
     You can extend this later for exams/interviews etc.
     """
-    t = user_text.lower()
-    if any(p in t for p in ["i'm better", "im better", "feeling better", "much better now"]):
-        for c in conversation_state["concerns"]:
-            if c["type"] == "health" and not c["resolved"]:
-                c["resolved"] = True
+    if hits is None:
+        hits = _scan(user_text)
+    if "resolved:health" in hits:
+        c = _open_concerns.pop("health", None)
+        if c is not None:
+            c["resolved"] = True
+            _touch("concerns")
 
 
 # ---------- Logging for research ----------
@@ -367,17 +471,85 @@ def _log_state(user_text: str):
     Append a JSON snapshot of the current state + raw user_text to state_log.jsonl.
     Useful for analysis / plotting in your research.
     """
-    snap = {
-        "ts": time.time(),
-        "message_index": conversation_state["message_count"],
-        "user_text": user_text,
-        "state": get_state_copy(),
-    }
-    try:
-        with STATE_LOG.open("a", encoding="utf8") as f:
-            f.write(json.dumps(snap) + "\n")
-    except Exception as e:
-        print("⚠️ failed to write state log:", e)
+    # same bytes orjson.dumps(snapshot dict) would give, serialized now (the
+    # lists keep changing after this turn); only file I/O is deferred
+    line = b"".join((
+        b'{"ts":', orjson.dumps(time.time()),
+        b',"message_index":', orjson.dumps(conversation_state["message_count"]),
+        b',"user_text":', orjson.dumps(user_text),
+        b',"state":', _state_json(), b"}\n",
+    ))
+    _log_queue.put_nowait(line)
+
+
+# key -> (version, json) for the _list_versions fields
+_list_json: Dict[str, tuple] = {}
+
+
+def _state_json() -> bytes:
+    """
+    orjson.dumps(get_state_copy()), re-serializing the open loops / concerns
+    lists only when their version moved since the last log line.
+    """
+    parts = []
+    for key, value in get_state_copy().items():
+        version = _list_versions.get(key)
+        if version is None:
+            frag = orjson.dumps(value)
+        else:
+            cached = _list_json.get(key)
+            if cached is None or cached[0] != version:
+                cached = (version, orjson.dumps(value))
+                _list_json[key] = cached
+            frag = cached[1]
+        parts.append(orjson.dumps(key) + b":" + frag)
+    return b"{" + b",".join(parts) + b"}"
+
+
+# One long-lived append handle, written in batches off the request path.
+_LOG_BATCH_MAX = 50
+_log_queue: "queue.Queue[Optional[bytes]]" = queue.Queue()
+
+
+def _log_worker() -> None:
+    fh = None
+    done = False
+    while not done:
+        # block for the first line, then take whatever else is already queued
+        batch = [_log_queue.get()]
+        while len(batch) < _LOG_BATCH_MAX:
+            try:
+                batch.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            # shutdown sentinel: nothing is queued after it
+            done = True
+            batch = [line for line in batch if line is not None]
+        if not batch:
+            continue
+        try:
+            if fh is None:
+                fh = STATE_LOG.open("ab")
+            fh.write(b"".join(batch))
+            fh.flush()
+        except Exception as e:
+            print("⚠️ failed to write state log:", e)
+    if fh is not None:
+        fh.close()
+
+
+_log_thread = threading.Thread(target=_log_worker, name="state-log", daemon=True)
+_log_thread.start()
+
+
+def _close_state_log() -> None:
+    """Write out queued snapshots and stop the writer (runs at exit)."""
+    _log_queue.put_nowait(None)
+    _log_thread.join(timeout=5.0)
+
+
+atexit.register(_close_state_log)
 
 
 # ---------- State update entrypoint ----------
@@ -389,21 +561,32 @@ def update_conversation_state_from_user(text: str):
     """
     conversation_state["message_count"] += 1
 
-    user_mood = detect_user_mood(text)
+    # one keyword pass for every rule below
+    hits = _scan(text)
+
+    user_mood = detect_user_mood(text, hits)
     conversation_state["user_mood"] = user_mood
     conversation_state["ai_mood"] = update_ai_mood(user_mood)
 
-    conversation_state["privacy_refusal"] = wants_privacy(text)
+    conversation_state["privacy_refusal"] = wants_privacy(text, hits)
 
-    maybe_register_open_loop(text)
+    maybe_register_open_loop(text, hits)
     update_relationship_stage()
-    update_ai_energy_and_trust(text)
+    update_ai_energy_and_trust(text, hits)
     update_engagement_from_text(text)
-    scan_for_concerns(text)
-    maybe_mark_concerns_resolved(text)
+    scan_for_concerns(text, hits)
+    maybe_mark_concerns_resolved(text, hits)
 
     _log_state(text)
 
+
+# ---------- Multi-message story buffering ----------
+
+# whole-message markers (exact match after strip + lower)
+_HOLD_MARKERS = frozenset({"wait", "one sec", "hold on", "more coming", "i'll explain", "ill explain"})
+_DONE_MARKERS = frozenset({"done", "that's it", "thats it", "finished", "end"})
+
+
 def should_hold_reply(text: str) -> bool:
     """
     Decide if we should *not* reply yet and just buffer this message.
@@ -412,14 +595,14 @@ def should_hold_reply(text: str) -> bool:
     t = (text or "").strip().lower()
 
     # explicit markers: user tells us they are sending in parts
-    if t in ["wait", "one sec", "hold on", "more coming", "i'll explain", "ill explain"]:
+    if t in _HOLD_MARKERS:
         conversation_state["story_buffer_active"] = True
         return True
 
     # if we're already in story mode, we usually buffer
     if conversation_state.get("story_buffer_active", False):
         # if they say done, we should NOT hold, we’ll flush instead
-        if t in ["done", "that's it", "thats it", "finished", "end"]:
+        if t in _DONE_MARKERS:
             return False
         # otherwise, keep buffering
         return True
@@ -436,26 +619,22 @@ def append_to_story_buffer(text: str):
     """
     Add this chunk to the story buffer.
     """
-    buf = conversation_state.get("story_buffer", "")
-    if buf:
-        buf = buf + " " + text.strip()
-    else:
-        buf = text.strip()
-    conversation_state["story_buffer"] = buf
+    # list of chunks, joined once in consume_story_with (not O(n^2) concat)
+    conversation_state["story_buffer"].append(text.strip())
 
 
 def consume_story_with(text: str) -> str:
     """
     When story is complete, merge buffer + current text and reset.
     """
-    buf = conversation_state.get("story_buffer", "").strip()
-    conversation_state["story_buffer"] = ""
+    buf = " ".join(conversation_state["story_buffer"]).strip()
+    conversation_state["story_buffer"] = []
     conversation_state["story_buffer_active"] = False
 
     if buf:
         # if 'done' / 'that's it' etc., don't duplicate that
         t = text.strip().lower()
-        if t in ["done", "that's it", "thats it", "finished", "end"]:
+        if t in _DONE_MARKERS:
             return buf
         return (buf + " " + text).strip()
 
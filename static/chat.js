@@ -61,10 +61,10 @@ function scrollToBottom() {
 async function loadHistory() {
   try {
     // if you update backend to be per-user, this query param will matter
-    const res = await fetch(`/messages?username=${encodeURIComponent(username)}`);
+    const res = await fetch(`/messages?username=${encodeURIComponent(username)}&since=0`);
     const data = await res.json();
     messagesEl.innerHTML = "";
-    data.forEach(appendMessage);
+    data.msgs.forEach(appendMessage);
     scrollToBottom();
   } catch (err) {
     console.error("Error loading history:", err);
@@ -165,6 +165,18 @@ function sendMessage() {
   bumpActivityTimer();
 }
 
+// Render (or re-render) the streaming bot bubble in place
+function upsertLiveBubble(row, msg) {
+  const fresh = createMessageBubble(msg);
+  if (row) {
+    row.replaceWith(fresh);
+  } else {
+    messagesEl.appendChild(fresh);
+  }
+  scrollToBottom();
+  return fresh;
+}
+
 /**
  * Actually send merged message to backend
  * once we've had 4s of no typing.
@@ -178,11 +190,15 @@ async function flushPendingChunks() {
 
   if (!mergedText) return;
 
+  let liveRow = null;   // bot bubble being filled by streamed deltas
+  let liveText = "";
+
   try {
     setSending(true);
     showTypingIndicator();
 
-    const res = await fetch("/send", {
+    // Server-Sent Events over a POST: "data: {delta}" frames, then "event: final"
+    const res = await fetch("/send_stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
@@ -191,17 +207,51 @@ async function flushPendingChunks() {
       }),
     });
 
-    hideTypingIndicator();
-
-    if (!res.ok) {
+    if (!res.ok || !res.body) {
+      hideTypingIndicator();
       console.error("Failed to send");
       setSending(false);
       return;
     }
 
-    const data = await res.json();
-    if (data.bot && data.bot.text && data.bot.text.trim() !== "") {
-      appendMessage(data.bot);
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buffer.indexOf("\n\n")) !== -1) {
+        const frame = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+
+        let event = "message";
+        let payload = "";
+        frame.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) payload += line.slice(5).trim();
+        });
+        if (!payload) continue;
+
+        const data = JSON.parse(payload);
+        if (event === "final") {
+          hideTypingIndicator();
+          // final text is post-processed server-side; it replaces the raw stream
+          if (data.bot && data.bot.text && data.bot.text.trim() !== "") {
+            liveRow = upsertLiveBubble(liveRow, data.bot);
+          } else if (liveRow) {
+            liveRow.remove();
+            liveRow = null;
+          }
+        } else if (data.delta) {
+          hideTypingIndicator();
+          liveText += data.delta;
+          liveRow = upsertLiveBubble(liveRow, { sender: "bot", text: liveText, time: "" });
+        }
+      }
     }
   } catch (err) {
     hideTypingIndicator();